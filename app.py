@@ -1,18 +1,37 @@
 import streamlit as st
 import pandas as pd
 import gspread
-from gspread_dataframe import get_as_dataframe
+from gspread.utils import absolute_range_name
 from oauth2client.service_account import ServiceAccountCredentials
 import plotly.express as px
 import plotly.graph_objects as go
 import plotly.io as pio
 from datetime import datetime
-from typing import Optional, Tuple, List
+from typing import Dict, Optional, Tuple, List
 import numpy as np
+from pandas.api.types import union_categoricals
 from scipy import stats
+from statsmodels.tsa.seasonal import STL
 from plotly.subplots import make_subplots
 import base64
 from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.parquet as pq
+import tempfile
+import xlsxwriter
 
 # =========================================================
 # ------------------- KONFIGURASI AWAL --------------------
@@ -243,6 +262,20 @@ h1, h2, h3, h4, h5, h6 {
     line-height: 1.65;
 }
 
+.freshness-badge {
+    display: inline-flex;
+    gap: 0.45rem;
+    align-items: center;
+    padding: 0.35rem 0.9rem;
+    margin: -1rem 0 1.2rem;
+    border-radius: 999px;
+    border: 1px solid var(--color-border);
+    background: var(--color-card);
+    color: var(--color-text-muted);
+    font-size: 0.85rem;
+    font-weight: 600;
+}
+
 .insight-card {
     background: var(--color-card);
     border-radius: var(--radius);
@@ -405,23 +438,961 @@ def render_metric_card(
     )
 
 
-@st.cache_data(ttl=600, show_spinner=False)
-def load_data(spreadsheet_url: str, sheet_name: str) -> Optional[pd.DataFrame]:
-    scope = [
+# Format tanggal yang didukung, urutan ini dipakai sebagai prioritas saat jumlah kecocokan sama
+DATE_FORMATS = [
+    '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y',  # Format Indonesia
+    '%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d',  # Format ISO
+    '%m-%d-%Y', '%m/%d/%Y', '%m.%d.%Y',  # Format US
+    '%d-%b-%Y', '%d/%b/%Y', '%d.%b.%Y',  # Format dengan nama bulan
+    '%d-%B-%Y', '%d/%B/%Y', '%d.%B.%Y',  # Format dengan nama bulan panjang
+]
+DATE_SNIFF_SAMPLE = 500
+SHEETS_EPOCH = "1899-12-30"
+SHEETS_SERIAL_MAX = 2958466  # 31-12-9999
+
+# Skema ringkas dataset hasil load
+CATEGORICAL_COLUMNS = ["Tag", "Kategori", "Arah Varians", "PLU", "TAG"]
+ARROW_STRING_COLUMNS = ["Nama Produk"]
+NUMERIC_COLUMNS = ["Selisih Qty (Pcs)", "Selisih Value (Rp)", "Varians Nilai Absolut", "Varians Qty Absolut"]
+
+# Grain rollup cube dan ukurannya (nama kolom ukuran = kolom baris yang dijumlahkan)
+CUBE_DIMENSIONS = ["Toko", "Tag", "Kategori", "PLU", "Nama Produk", "Arah Varians"]
+CUBE_MEASURES = {
+    "Selisih Qty (Pcs)": ("Selisih Qty (Pcs)", "sum"),
+    "Jumlah Qty": ("Selisih Qty (Pcs)", "count"),
+    "Varians Qty Absolut": ("Varians Qty Absolut", "sum"),
+    "Selisih Value (Rp)": ("Selisih Value (Rp)", "sum"),
+    "Jumlah Nilai": ("Selisih Value (Rp)", "count"),
+    "Varians Nilai Absolut": ("Varians Nilai Absolut", "sum"),
+}
+
+
+def parse_date_column(series: pd.Series) -> Tuple[pd.Series, dict]:
+    # Parse kolom tanggal multi-format secara vektor
+    report = {}
+    if pd.api.types.is_datetime64_any_dtype(series):
+        report["datetime"] = int(series.notna().sum())
+        report["NaT"] = int(series.isna().sum())
+        return series, report
+
+    values = np.full(len(series), np.datetime64("NaT"), dtype="datetime64[ns]")
+    pending = series.notna().to_numpy().copy()
+
+    # Tanggal serial Google Sheets (UNFORMATTED_VALUE + SERIAL_NUMBER): hari sejak 1899-12-30
+    numbers = pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64")
+    serial = pending & (numbers >= 1) & (numbers < SHEETS_SERIAL_MAX)
+    if serial.any():
+        values[serial] = pd.to_datetime(numbers[serial], unit="D", origin=SHEETS_EPOCH).to_numpy(dtype="datetime64[ns]")
+        pending &= ~serial
+        report["serial"] = int(serial.sum())
+
+    text = series.astype("string").str.strip()
+    text = text.mask(text == "")
+    pending &= text.notna().to_numpy()
+
+    sample = text[pending].drop_duplicates().head(DATE_SNIFF_SAMPLE)
+    hits = {
+        fmt: int(pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum())
+        for fmt in DATE_FORMATS
+    }
+    # sorted() stabil: format dengan kecocokan sama tetap mengikuti prioritas DATE_FORMATS
+    ordered = sorted(DATE_FORMATS, key=lambda fmt: -hits[fmt]) if pending.any() else []
+
+    for fmt in ordered:
+        if not pending.any():
+            break
+        positions = np.flatnonzero(pending)
+        parsed = pd.to_datetime(text.iloc[positions], format=fmt, errors="coerce")
+        matched = parsed.notna().to_numpy()
+        if matched.any():
+            values[positions[matched]] = parsed.to_numpy(dtype="datetime64[ns]")[matched]
+            pending[positions[matched]] = False
+            report[fmt] = int(matched.sum())
+
+    # Jika semua format gagal, coba parsing otomatis per nilai
+    if pending.any():
+        positions = np.flatnonzero(pending)
+        try:
+            parsed = pd.to_datetime(text.iloc[positions], format="mixed", errors="coerce")
+        except (ValueError, TypeError):
+            parsed = pd.Series(pd.NaT, index=text.index[positions])
+        matched = parsed.notna().to_numpy()
+        if matched.any():
+            values[positions[matched]] = parsed.to_numpy(dtype="datetime64[ns]")[matched]
+            report["inferensi"] = int(matched.sum())
+
+    report["NaT"] = int(np.isnat(values).sum())
+    return pd.Series(values, index=series.index, name=series.name), report
+
+
+SYNC_TAIL_ROWS = 20
+# Kolom sheet yang dipakai dashboard; hanya kolom ini yang diambil dari Google Sheets
+SOURCE_COLUMNS = ["TANGGAL", "SELISIH_QTY", "SELISIH_RP", "CATEGORY_NAME", "DESCP", "PLU", "TAG"]
+PLU_ALIASES = ("PLU", "ITEM", "KODE")
+SNAPSHOT_DIR = Path(os.environ.get("SO_SNAPSHOT_DIR", ".snapshots"))
+SNAPSHOT_META_KEY = b"rekapso_sync"
+DATA_TTL_SECONDS = 600
+DATA_RETRY_SECONDS = 60
+# Mode multi-toko: pemuatan paralel terbatas, retry per toko, dan batas tunggu per rerun
+DEFAULT_STORE_NAME = "2GC6 BAROS PANDEGLANG"
+STORE_LOAD_WORKERS = 6
+STORE_LOAD_RETRIES = 2
+STORE_RETRY_SECONDS = 2
+STORE_LOAD_TIMEOUT_SECONDS = 20
+# Worksheet per periode (RekapSO_2025_01, RekapSO_2025_Q1) dianggap arsip setelah masa tenggang
+WORKSHEET_PERIOD_PATTERN = re.compile(r"_(\d{4})_(?:Q([1-4])|(0[1-9]|1[0-2]))$", re.IGNORECASE)
+PERIOD_MIN_YEAR = 2000
+PERIOD_CLOSE_GRACE_DAYS = 7
+# Jumlah kombinasi (versi dataset, filter) yang hasilnya disimpan bersama antar sesi
+FILTER_CACHE_SIZE = 32
+# Ambang scatter: di atas SCATTER_WEBGL_ROWS titik dirender lewat WebGL, di atas
+# SCATTER_DENSITY_ROWS diganti kepadatan 2D hasil binning server + titik outlier
+SCATTER_WEBGL_ROWS = 5000
+SCATTER_DENSITY_ROWS = 50000
+SCATTER_DENSITY_BINS = 80
+SCATTER_MAX_OUTLIERS = 2000
+# Jumlah node per level treemap (Kategori → Tag → PLU); sisanya digabung ke "Lainnya"
+TREEMAP_TOP_K = {"Kategori": 10, "Tag": 8, "PLU": 15}
+OTHERS_LABEL = "Lainnya"
+HISTOGRAM_BINS = 30
+BOX_MAX_OUTLIERS = 500
+# Kandidat periode musiman jadwal SO (hari) dan panjang jendela fit ulang inkremental (periode)
+DECOMPOSITION_PERIODS = (7, 14, 30)
+DECOMPOSITION_REFIT_PERIODS = 6
+# Ekspor data terfilter: ditulis per potongan ke direktori sementara, satu file per fingerprint
+EXPORT_DIR = Path(os.environ.get("SO_EXPORT_DIR", Path(tempfile.gettempdir()) / "rekapso_exports"))
+EXPORT_CHUNK_ROWS = 50000
+EXPORT_MAX_AGE_SECONDS = 3600
+# xlsxwriter butuh ~15 µs per sel; data lebih besar diarahkan ke CSV/Parquet agar satu klik tetap singkat
+EXCEL_MAX_ROWS = 100000
+
+
+@st.cache_resource(show_spinner=False)
+def get_sync_store() -> dict:
+    # Status sinkronisasi per (url, sheet) yang bertahan melewati TTL `load_data`
+    return {"lock": threading.Lock(), "entries": {}, "key_locks": {}}
+
+
+def _sync_key_lock(store: dict, cache_key: Tuple[str, str]) -> threading.RLock:
+    with store["lock"]:
+        return store["key_locks"].setdefault(cache_key, threading.RLock())
+
+
+class SheetsClientPool:
+    # Client gspread bersama untuk seluruh proses
+
+    SCOPE = [
         "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive"
     ]
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._client: Optional[gspread.Client] = None
+        self._spreadsheets = {}
+        self._worksheets = {}
+        self._titles = {}
+        self._listing = set()
+        self._timings = {}
+        # Satu pool terbatas untuk semua pemuatan paralel dan pembaruan latar
+        self.executor = ThreadPoolExecutor(max_workers=STORE_LOAD_WORKERS, thread_name_prefix="sheets")
+
+    @contextmanager
+    def timed(self, label: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                count, total, _ = self._timings.get(label, (0, 0.0, 0.0))
+                self._timings[label] = (count + 1, total + elapsed, elapsed)
+
+    def _get_client(self) -> gspread.Client:
+        with self._lock:
+            client = self._client
+        if client is None:
+            with self.timed("auth"):
+                creds_dict = st.secrets["gcp_service_account"]
+                creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, self.SCOPE)
+                client = gspread.authorize(creds)
+            with self._lock:
+                self._client = client
+        return client
+
+    def worksheet(self, spreadsheet_url: str, sheet_name: str) -> gspread.Worksheet:
+        with self._lock:
+            worksheet = self._worksheets.get((spreadsheet_url, sheet_name))
+            spreadsheet = self._spreadsheets.get(spreadsheet_url)
+        if worksheet is not None:
+            return worksheet
+        client = self._get_client()
+        with self.timed("open"):
+            if spreadsheet is None:
+                spreadsheet = client.open_by_url(spreadsheet_url)
+            worksheet = spreadsheet.worksheet(sheet_name)
+        with self._lock:
+            self._spreadsheets[spreadsheet_url] = spreadsheet
+            self._worksheets[(spreadsheet_url, sheet_name)] = worksheet
+        return worksheet
+
+    def worksheet_titles(self, spreadsheet_url: str) -> List[str]:
+        # Judul semua worksheet (urutan tab), stale-while-revalidate dengan TTL data
+        with self._lock:
+            listed = self._titles.get(spreadsheet_url)
+            refresh = (
+                listed is not None
+                and time.time() - listed[0] >= DATA_TTL_SECONDS
+                and spreadsheet_url not in self._listing
+            )
+            if refresh:
+                self._listing.add(spreadsheet_url)
+        if listed is None:
+            return self._list_titles(spreadsheet_url)
+        if refresh:
+            self.executor.submit(self._list_titles, spreadsheet_url)
+        return listed[1]
+
+    def _list_titles(self, spreadsheet_url: str) -> List[str]:
+        try:
+            with self._lock:
+                spreadsheet = self._spreadsheets.get(spreadsheet_url)
+            client = self._get_client()
+            with self.timed("open"):
+                if spreadsheet is None:
+                    spreadsheet = client.open_by_url(spreadsheet_url)
+                worksheets = spreadsheet.worksheets()
+            titles = [worksheet.title for worksheet in worksheets]
+            with self._lock:
+                self._spreadsheets[spreadsheet_url] = spreadsheet
+                for worksheet in worksheets:
+                    self._worksheets.setdefault((spreadsheet_url, worksheet.title), worksheet)
+                self._titles[spreadsheet_url] = (time.time(), titles)
+            return titles
+        except Exception:
+            with self._lock:
+                listed = self._titles.get(spreadsheet_url)
+                if listed is not None:
+                    # Gagal di latar: pertahankan daftar lama, coba lagi setelah DATA_RETRY_SECONDS
+                    self._titles[spreadsheet_url] = (time.time() - DATA_TTL_SECONDS + DATA_RETRY_SECONDS, listed[1])
+            if listed is None:
+                raise
+            return listed[1]
+        finally:
+            with self._lock:
+                self._listing.discard(spreadsheet_url)
+
+    def invalidate(self, spreadsheet_url: str) -> None:
+        # Buang handle yang mungkin basi (sheet diganti nama/dihapus)
+        with self._lock:
+            self._spreadsheets.pop(spreadsheet_url, None)
+            self._titles.pop(spreadsheet_url, None)
+            for key in [key for key in self._worksheets if key[0] == spreadsheet_url]:
+                del self._worksheets[key]
+
+    def header(self, worksheet: gspread.Worksheet) -> list:
+        with self.timed("fetch"):
+            return worksheet.row_values(1)
+
+    def batch_get_columns(self, worksheet: gspread.Worksheet, ranges: List[str]) -> List[list]:
+        # Satu request values:batchGet; setiap range satu kolom, nilai mentah dan tanggal serial
+        with self.timed("fetch"):
+            response = worksheet.spreadsheet.values_batch_get(
+                ranges,
+                params={
+                    "majorDimension": "COLUMNS",
+                    "valueRenderOption": "UNFORMATTED_VALUE",
+                    "dateTimeRenderOption": "SERIAL_NUMBER"
+                }
+            )
+        return [(value_range.get("values") or [[]])[0] for value_range in response.get("valueRanges", [])]
+
+    def timing_report(self) -> pd.DataFrame:
+        with self._lock:
+            timings = dict(self._timings)
+        return pd.DataFrame(
+            [
+                {
+                    "Tahap": label,
+                    "Jumlah": count,
+                    "Total (ms)": round(total * 1000, 1),
+                    "Rata-rata (ms)": round(total / count * 1000, 1),
+                    "Terakhir (ms)": round(last * 1000, 1)
+                }
+                for label, (count, total, last) in timings.items()
+            ]
+        )
+
+
+@st.cache_resource(show_spinner=False)
+def get_sheets_client_pool() -> SheetsClientPool:
+    return SheetsClientPool()
+
+
+def _column_letter(index: int) -> str:
+    return gspread.utils.rowcol_to_a1(1, index + 1).rstrip("0123456789")
+
+
+def resolve_source_columns(header: list) -> List[Tuple[str, int]]:
+    # Pilih (nama, indeks) kolom sheet yang benar-benar dipakai dashboard
+    stripped = [str(name).strip() for name in header]
+    columns = [(name, stripped.index(name)) for name in SOURCE_COLUMNS if name in stripped]
+    if "PLU" not in stripped:
+        # Sama seperti deteksi PLU di process_raw_frame: kolom dengan nama mirip PLU
+        selected = {index for _, index in columns}
+        for index, name in enumerate(stripped):
+            if index not in selected and any(alias in name.upper() for alias in PLU_ALIASES):
+                columns.append((name, index))
+                break
+    return columns
+
+
+def _column_ranges(sheet_title: str, columns: List[Tuple[str, int]], first_row: int, last_row: Optional[int] = None) -> List[str]:
+    end = "" if last_row is None else str(last_row)
+    return [
+        absolute_range_name(sheet_title, f"{_column_letter(index)}{first_row}:{_column_letter(index)}{end}")
+        for _, index in columns
+    ]
+
+
+def _typed_column(values: list, length: int) -> np.ndarray:
+    # Bangun kolom numpy bertipe langsung dari nilai mentah (tanpa parser teks)
+    arr = np.empty(length, dtype=object)
+    arr[:] = ""
+    arr[:len(values)] = values
+    filled = arr != ""
+    numbers = np.full(length, np.nan)
+    try:
+        numbers[filled] = arr[filled].astype(np.float64)
+    except (TypeError, ValueError):
+        arr[~filled] = np.nan
+        return arr
+    if filled.all() and np.array_equal(numbers, np.floor(numbers)):
+        return numbers.astype(np.int64)
+    return numbers
+
+
+def _columns_to_frame(columns: List[Tuple[str, int]], column_values: List[list], start: int) -> pd.DataFrame:
+    length = max((len(values) for values in column_values), default=0)
+    data = {name: _typed_column(values, length) for (name, _), values in zip(columns, column_values)}
+    return pd.DataFrame(data, index=pd.RangeIndex(start, start + length))
+
+
+def _hash_rows(column_values: List[list], start: int, stop: int) -> str:
+    rows = [[values[i] if i < len(values) else "" for values in column_values] for i in range(start, stop)]
+    return hashlib.sha1(json.dumps(rows, default=str).encode("utf-8")).hexdigest()
+
+
+def _merge_reports(*reports: dict) -> dict:
+    merged = {}
+    for report in reports:
+        for key, value in report.items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _sync_full(worksheet: gspread.Worksheet, pool: SheetsClientPool) -> Tuple[pd.DataFrame, Optional[dict]]:
+    header = pool.header(worksheet)
+    if not header:
+        return pd.DataFrame(), None
+    columns = resolve_source_columns(header)
+    column_values = pool.batch_get_columns(worksheet, _column_ranges(worksheet.title, columns, 2)) if columns else []
+    row_count = max((len(values) for values in column_values), default=0)
+    df = process_raw_frame(_columns_to_frame(columns, column_values, 0))
+    state = {
+        "columns": columns,
+        "row_count": row_count,
+        "tail_hash": _hash_rows(column_values, max(row_count - SYNC_TAIL_ROWS, 0), row_count),
+        "frame": df,
+        "fetched_at": datetime.now()
+    }
+    df.attrs["sync_report"] = {"mode": "penuh", "baris_diambil": row_count, "total_baris": row_count}
+    df.attrs["version"] = f"{state['row_count']}-{state['tail_hash'][:10]}"
+    return df, state
+
+
+def _sync_incremental(
+    worksheet: gspread.Worksheet,
+    state: dict,
+    pool: SheetsClientPool
+) -> Tuple[Optional[pd.DataFrame], Optional[dict]]:
+    # Ambil hanya baris baru; `None` berarti prefiks berubah dan perlu muat ulang penuh
+    columns = state.get("columns")
+    if not columns:
+        return None, None
+    start = max(state["row_count"] - SYNC_TAIL_ROWS, 0)
+    overlap = state["row_count"] - start
+
+    # Sel header dan ekor lama ikut diambil dalam satu request untuk verifikasi prefiks
+    fetched = pool.batch_get_columns(
+        worksheet,
+        _column_ranges(worksheet.title, columns, 1, 1) + _column_ranges(worksheet.title, columns, start + 2)
+    )
+    header_cells, column_values = fetched[:len(columns)], fetched[len(columns):]
+    length = max((len(values) for values in column_values), default=0)
+    if (
+        [str(cell[0]).strip() if cell else "" for cell in header_cells] != [name for name, _ in columns]
+        or length < overlap
+        or _hash_rows(column_values, 0, overlap) != state["tail_hash"]
+    ):
+        return None, None
+
+    new_count = length - overlap
+    old_df = state["frame"]
+    if new_count == 0:
+        df = old_df
+    else:
+        new_df = process_raw_frame(
+            _columns_to_frame(columns, [values[overlap:] for values in column_values], state["row_count"])
+        )
+        df = concat_compact([old_df, new_df])
+        df.attrs["date_parse_report"] = _merge_reports(
+            old_df.attrs.get("date_parse_report", {}),
+            new_df.attrs.get("date_parse_report", {})
+        )
+        df.attrs["memory_report"] = {
+            "sebelum": old_df.attrs.get("memory_report", {}).get("sebelum", 0)
+            + new_df.attrs.get("memory_report", {}).get("sebelum", 0),
+            "sesudah": int(df.memory_usage(deep=True).sum())
+        }
+
+    row_count = state["row_count"] + new_count
+    new_state = {
+        "columns": columns,
+        "row_count": row_count,
+        "tail_hash": _hash_rows(column_values, max(length - SYNC_TAIL_ROWS, 0), length),
+        "frame": df,
+        "fetched_at": datetime.now()
+    }
+    df.attrs["sync_report"] = {"mode": "inkremental", "baris_diambil": length, "total_baris": row_count}
+    df.attrs["version"] = f"{row_count}-{new_state['tail_hash'][:10]}"
+    return df, new_state
+
+
+def snapshot_path(cache_key: Tuple[str, str]) -> Path:
+    digest = hashlib.sha1("|".join(cache_key).encode("utf-8")).hexdigest()[:16]
+    return SNAPSHOT_DIR / f"rekapso-{digest}.parquet"
+
+
+def write_snapshot(cache_key: Tuple[str, str], state: dict) -> None:
+    # Simpan frame terproses + status sinkronisasi sebagai snapshot Parquet (atomik)
+    frame = state["frame"]
+    meta = {
+        "columns": state["columns"],
+        "row_count": state["row_count"],
+        "tail_hash": state["tail_hash"],
+        "fetched_at": state["fetched_at"].isoformat(),
+        "attrs": frame.attrs
+    }
+    path = snapshot_path(cache_key)
+    tmp_path = path.with_suffix(".parquet.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table = pa.Table.from_pandas(frame, preserve_index=True)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            SNAPSHOT_META_KEY: json.dumps(meta, default=str).encode("utf-8")
+        })
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    except (OSError, pa.ArrowException) as exc:
+        # Snapshot hanya akselerator warm start; kegagalan tidak boleh menggagalkan pemuatan
+        frame.attrs["snapshot_error"] = str(exc)
+
+
+def read_snapshot(cache_key: Tuple[str, str]) -> Optional[dict]:
+    # Baca snapshot via memory-map dan kembalikan status sinkronisasi yang siap dipakai
+    path = snapshot_path(cache_key)
+    if not path.exists():
+        return None
+    started = time.perf_counter()
+    try:
+        table = pq.read_table(path, memory_map=True)
+        meta = json.loads(table.schema.metadata[SNAPSHOT_META_KEY])
+        # Parquet mengembalikan kategori bernilai integer (PLU) sebagai int64 biasa: pulihkan skema ringkas
+        frame = compact_frame(table.to_pandas())
+        fetched_at = datetime.fromisoformat(meta["fetched_at"])
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        return None
+    frame.attrs = meta.get("attrs", {})
+    frame.attrs["snapshot_read_ms"] = (time.perf_counter() - started) * 1000
+    return {
+        "columns": meta.get("columns"),
+        "row_count": meta["row_count"],
+        "tail_hash": meta["tail_hash"],
+        "frame": frame,
+        "fetched_at": fetched_at
+    }
+
+
+def peek_sync_state(cache_key: Tuple[str, str], store: dict) -> Optional[dict]:
+    # Status sinkronisasi terkini; pada proses yang baru start, diisi dari snapshot disk
+    with store["lock"]:
+        state = store["entries"].get(cache_key)
+    if state is not None:
+        return state
+    with _sync_key_lock(store, cache_key):
+        with store["lock"]:
+            state = store["entries"].get(cache_key)
+        if state is None:
+            state = read_snapshot(cache_key)
+            if state is not None:
+                with store["lock"]:
+                    store["entries"][cache_key] = state
+    return state
+
+
+def sync_worksheet(
+    worksheet: gspread.Worksheet,
+    cache_key: Tuple[str, str],
+    store: dict,
+    pool: SheetsClientPool
+) -> pd.DataFrame:
+    # Sinkronkan worksheet secara inkremental
+    with _sync_key_lock(store, cache_key):
+        state = peek_sync_state(cache_key, store)
+        df = None
+        if state is not None:
+            try:
+                df, new_state = _sync_incremental(worksheet, state, pool)
+            except Exception:
+                # Append yang gagal diproses tidak boleh terulang selamanya: muat ulang penuh
+                df = None
+        if df is None:
+            df, new_state = _sync_full(worksheet, pool)
+        with store["lock"]:
+            if new_state is not None:
+                store["entries"][cache_key] = new_state
+            else:
+                store["entries"].pop(cache_key, None)
+        if new_state is not None and (
+            state is None or new_state["tail_hash"] != state["tail_hash"] or new_state["row_count"] != state["row_count"]
+        ):
+            write_snapshot(cache_key, new_state)
+    return df
+
+
+def load_data(spreadsheet_url: str, sheet_name: str, sync_store: dict, pool: SheetsClientPool) -> pd.DataFrame:
+    # Ambil dan proses worksheet; dapat dipanggil dari thread latar, error diteruskan ke pemanggil
+    cache_key = (spreadsheet_url, sheet_name)
+    try:
+        worksheet = pool.worksheet(spreadsheet_url, sheet_name)
+        return sync_worksheet(worksheet, cache_key, sync_store, pool)
+    except (gspread.exceptions.APIError, gspread.exceptions.WorksheetNotFound):
+        # Handle bisa basi (sheet diganti nama/dihapus): buka ulang sekali
+        pool.invalidate(spreadsheet_url)
+        worksheet = pool.worksheet(spreadsheet_url, sheet_name)
+        return sync_worksheet(worksheet, cache_key, sync_store, pool)
+
+
+def _date_bounds(date_range) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    if isinstance(date_range, tuple) and len(date_range) == 2:
+        start_date, end_date = date_range
+    else:
+        start_date = end_date = date_range[0] if date_range else datetime.today()
+
+    start_ts = pd.to_datetime(start_date)
+    end_ts = pd.to_datetime(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    return start_ts, end_ts
+
+
+class FilterIndex:
+    # Indeks filter sidebar yang dibangun sekali per load
+
+    BITMAP_COLUMNS = ("Tag", "Arah Varians", "Toko")
+
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+        self.dates = frame["Tanggal Stock Opname"].to_numpy()
+        self.bitmaps: Dict[str, Dict[str, np.ndarray]] = {}
+        for column in self.BITMAP_COLUMNS:
+            if column not in frame.columns:
+                continue
+            series = frame[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                codes = series.cat.codes.to_numpy()
+                self.bitmaps[column] = {
+                    str(value): codes == code for code, value in enumerate(series.cat.categories)
+                }
+            else:
+                values = series.astype(str).to_numpy()
+                self.bitmaps[column] = {str(value): values == value for value in np.unique(values)}
+
+        self.dates.flags.writeable = False
+        for bitmaps in self.bitmaps.values():
+            for bitmap in bitmaps.values():
+                bitmap.flags.writeable = False
+
+    def select(
+        self,
+        date_range: Tuple[datetime, datetime],
+        selected_tags: List[str],
+        selected_direction: List[str],
+        selected_stores: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        start_ts, end_ts = _date_bounds(date_range)
+        start = int(np.searchsorted(self.dates, start_ts.to_datetime64(), side="left"))
+        stop = int(np.searchsorted(self.dates, end_ts.to_datetime64(), side="right"))
+
+        mask = None
+        for column, selected in (
+            ("Tag", selected_tags),
+            ("Arah Varians", selected_direction),
+            ("Toko", selected_stores),
+        ):
+            if not selected or "Semua" in selected:
+                continue
+            column_mask = np.zeros(max(stop - start, 0), dtype=bool)
+            for value in selected:
+                bitmap = self.bitmaps.get(column, {}).get(str(value))
+                if bitmap is not None:
+                    column_mask |= bitmap[start:stop]
+            mask = column_mask if mask is None else mask & column_mask
+
+        window = self.frame.iloc[start:stop]
+        if mask is None:
+            return window
+        return window.take(np.flatnonzero(mask))
+
+
+@dataclass(frozen=True)
+class Dataset:
+    # Dataset terproses yang dibagi apa adanya oleh semua sesi (tanpa pickle/salinan)
+
+    frame: pd.DataFrame
+    cube: pd.DataFrame
+    index: FilterIndex
+    cube_index: FilterIndex
+    version: str
+    fetched_at: datetime
+    source: str  # "sheet" atau "snapshot"
+
+
+def build_rollup_cube(df: pd.DataFrame) -> pd.DataFrame:
+    # Rollup harian × Tag × Kategori × PLU yang dibangun sekali per load
+    dimensions = [column for column in CUBE_DIMENSIONS if column in df.columns]
+    if df.empty or "Tanggal Stock Opname" not in df.columns:
+        return pd.DataFrame(columns=["Tanggal Stock Opname"] + dimensions + list(CUBE_MEASURES))
+    # Kolom int32 hasil compact_frame dilebarkan dulu agar jumlah per grup tidak overflow
+    widened = {
+        column: df[column].astype("int64")
+        for column in NUMERIC_COLUMNS
+        if column in df.columns and pd.api.types.is_integer_dtype(df[column])
+    }
+    source = df.assign(**widened) if widened else df
+    day = source["Tanggal Stock Opname"].dt.normalize()
+    cube = (
+        source.groupby([day] + dimensions, observed=True, dropna=False, sort=False)
+        .agg(**CUBE_MEASURES)
+        .reset_index()
+    )
+    return cube
+
+
+def build_dataset(frame: pd.DataFrame, fetched_at: datetime, source: str) -> Dataset:
+    if "Tanggal Stock Opname" in frame.columns:
+        # PERBAIKAN: Tangani tanggal yang tidak valid
+        frame = frame[frame["Tanggal Stock Opname"].notna()]
+        # Urut per tanggal agar FilterIndex bisa memotong rentang tanggal tanpa masking
+        frame = frame.sort_values("Tanggal Stock Opname", kind="stable")
+    else:
+        frame = frame.assign(**{"Tanggal Stock Opname": pd.Series(dtype="datetime64[ns]")})
+    cube = build_rollup_cube(frame).sort_values("Tanggal Stock Opname", kind="stable", ignore_index=True)
+    return Dataset(
+        frame=frame,
+        cube=cube,
+        index=FilterIndex(frame),
+        cube_index=FilterIndex(cube),
+        version=frame.attrs.get("version", ""),
+        fetched_at=fetched_at,
+        source=source
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_dataset_store() -> dict:
+    # Dataset terkini per (url, sheet) yang disajikan ke semua sesi
+    return {"lock": threading.Lock(), "entries": {}}
+
+
+def load_sheet_with_retry(cache_key: Tuple[str, str], sync_store: dict, pool: SheetsClientPool) -> pd.DataFrame:
+    for attempt in range(STORE_LOAD_RETRIES + 1):
+        try:
+            return load_data(*cache_key, sync_store, pool)
+        except Exception:
+            if attempt == STORE_LOAD_RETRIES:
+                raise
+        time.sleep(STORE_RETRY_SECONDS * (attempt + 1))
+
+
+def _refresh_dataset(
+    cache_key: Tuple[str, str],
+    dataset_store: dict,
+    sync_store: dict,
+    pool: SheetsClientPool
+) -> None:
+    # ``load_lock`` sudah diambil pemanggil di bawah kunci store (lihat _get_dataset) dan
+    # dilepas di sini, sehingga sesi yang menunggu pemuatan pertama tidak bisa lolos lebih dulu
+    entry = dataset_store["entries"][cache_key]
     try:
-        creds_dict = st.secrets["gcp_service_account"]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        spreadsheet = client.open_by_url(spreadsheet_url)
-        worksheet = spreadsheet.worksheet(sheet_name)
-        df = get_as_dataframe(worksheet, evaluate_formulas=True)
-    except Exception as exc:
-        st.error(f"Gagal memuat data: {exc}")
+        try:
+            df = load_sheet_with_retry(cache_key, sync_store, pool)
+            current = entry["dataset"]
+            if current is not None and current.version and df.attrs.get("version") == current.version:
+                # Sheet tidak berubah: pakai ulang frame/cube/indeks agar FilterView lama tetap satu salinan
+                dataset = replace(current, fetched_at=datetime.now(), source="sheet")
+            else:
+                dataset = build_dataset(df, datetime.now(), "sheet")
+            error = None
+        except Exception as exc:
+            dataset, error = None, str(exc)
+        with dataset_store["lock"]:
+            # Tukar referensi secara atomik; sesi yang sedang berjalan tetap memegang frame lama
+            if dataset is not None:
+                entry["dataset"] = dataset
+            entry["error"] = error
+            entry["refreshing"] = False
+    finally:
+        entry["load_lock"].release()
+
+
+def get_dataset(spreadsheet_url: str, sheet_name: str) -> Tuple[Optional[Dataset], dict]:
+    # Stale-while-revalidate: sajikan dataset yang ada, perbarui di thread latar bila kedaluwarsa
+    return _get_dataset(
+        (spreadsheet_url, sheet_name),
+        get_dataset_store(),
+        get_sync_store(),
+        get_sheets_client_pool()
+    )
+
+
+def _get_dataset(
+    cache_key: Tuple[str, str],
+    dataset_store: dict,
+    sync_store: dict,
+    pool: SheetsClientPool,
+    archived_after: Optional[datetime] = None
+) -> Tuple[Optional[Dataset], dict]:
+    # Store diteruskan dari thread utama agar fungsi ini aman dipanggil dari worker.
+    # Worksheet arsip tidak diperbarui lagi bila datanya diambil setelah ``archived_after``
+    # (akhir periode + masa tenggang); data yang lebih lama tetap divalidasi ulang sekali.
+    with dataset_store["lock"]:
+        entry = dataset_store["entries"].setdefault(cache_key, {
+            "dataset": None,
+            "refreshing": False,
+            "error": None,
+            "attempted_at": 0.0,
+            "load_lock": threading.Lock()
+        })
+
+    if entry["dataset"] is None:
+        state = peek_sync_state(cache_key, sync_store)
+        if state is not None:
+            with dataset_store["lock"]:
+                if entry["dataset"] is None:
+                    entry["dataset"] = build_dataset(state["frame"], state["fetched_at"], "snapshot")
+
+    with dataset_store["lock"]:
+        dataset = entry["dataset"]
+        stale = dataset is None or not is_archived_dataset(dataset, archived_after) and (
+            dataset.source == "snapshot"
+            or (datetime.now() - dataset.fetched_at).total_seconds() > DATA_TTL_SECONDS
+        )
+        # Gagal (termasuk pemuatan pertama) tidak dicoba ulang di setiap rerun
+        backoff = DATA_RETRY_SECONDS if entry["error"] else 0
+        start_refresh = stale and not entry["refreshing"] and time.time() - entry["attempted_at"] >= backoff
+        if start_refresh:
+            entry["refreshing"] = True
+            entry["attempted_at"] = time.time()
+            entry["load_lock"].acquire()
+
+    if dataset is None:
+        if start_refresh:
+            _refresh_dataset(cache_key, dataset_store, sync_store, pool)
+        else:
+            # Sesi lain sedang melakukan pemuatan pertama: tunggu hasilnya
+            with entry["load_lock"]:
+                pass
+    elif start_refresh:
+        pool.executor.submit(_refresh_dataset, cache_key, dataset_store, sync_store, pool)
+    return entry["dataset"], entry
+
+
+def parse_store_mapping(text: str) -> Dict[str, str]:
+    # Baris "Nama Toko = URL spreadsheet" menjadi mapping toko → URL (urutan dipertahankan)
+    stores: Dict[str, str] = {}
+    for line in text.splitlines():
+        name, separator, url = line.partition("=")
+        if separator and name.strip() and url.strip():
+            stores[name.strip()] = url.strip()
+    return stores
+
+
+@st.cache_resource(show_spinner=False)
+def get_union_store() -> dict:
+    # Dataset gabungan (multi-toko/multi-worksheet) per kombinasi versi sumber, dibagi antar sesi
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
+
+
+def is_pattern_spec(sheet_spec: str) -> bool:
+    return "," in sheet_spec or any(char in sheet_spec for char in "*?[")
+
+
+def resolve_worksheets(spreadsheet_url: str, sheet_spec: str, pool: SheetsClientPool) -> List[str]:
+    # Nama worksheet dari input: satu nama, daftar dipisah koma, atau pola glob (RekapSO_2025_*)
+    names = [name.strip() for name in sheet_spec.split(",") if name.strip()]
+    if not any(is_pattern_spec(name) for name in names):
+        return names
+    return [
+        title for title in pool.worksheet_titles(spreadsheet_url)
+        if any(fnmatch.fnmatchcase(title, name) for name in names)
+    ]
+
+
+def worksheet_archive_cutoff(sheet_name: str) -> Optional[datetime]:
+    # Akhir periode pada akhiran nama sheet (tahun + bulan/kuartal) ditambah masa tenggang
+    match = WORKSHEET_PERIOD_PATTERN.search(sheet_name)
+    if match is None:
+        return None
+    year, quarter, month = match.groups()
+    if not PERIOD_MIN_YEAR <= int(year) <= datetime.now().year + 1:
         return None
+    last_month = int(quarter) * 3 if quarter else int(month)
+    period_end = pd.Timestamp(int(year), last_month, 1) + pd.offsets.MonthEnd(0) + pd.Timedelta(days=1)
+    return (period_end + pd.Timedelta(days=PERIOD_CLOSE_GRACE_DAYS)).to_pydatetime()
+
+
+def is_archived_dataset(dataset: Dataset, archived_after: Optional[datetime]) -> bool:
+    return archived_after is not None and dataset.fetched_at > archived_after
+
+
+def source_label(row: dict) -> str:
+    return " / ".join(str(row[column]) for column in ("Toko", "Worksheet") if row.get(column))
+
+
+def load_source_datasets(
+    store_urls: Dict[Optional[str], str],
+    sheet_spec: str
+) -> Tuple[Dict[Tuple[Optional[str], str], Dataset], List[dict]]:
+    # Muat semua pasangan (toko, worksheet) paralel; yang lewat batas waktu dilewati rerun ini
+    dataset_store = get_dataset_store()
+    sync_store = get_sync_store()
+    pool = get_sheets_client_pool()
+    executor = pool.executor
+    deadline = time.monotonic() + STORE_LOAD_TIMEOUT_SECONDS
 
+    listings = {
+        store: executor.submit(resolve_worksheets, url, sheet_spec, pool)
+        for store, url in store_urls.items()
+    }
+    wait(listings.values(), timeout=STORE_LOAD_TIMEOUT_SECONDS)
+
+    report = []
+    futures = {}
+    for store, listing in listings.items():
+        base = {"Toko": store} if store is not None else {}
+        if not listing.done():
+            report.append({**base, "Worksheet": sheet_spec, "Status": "masih dimuat", "Baris": 0, "Data per": None})
+            continue
+        try:
+            sheet_names = listing.result()
+        except Exception as exc:
+            sheet_names, error = [], str(exc)
+        else:
+            error = "tidak ada worksheet yang cocok"
+        if not sheet_names:
+            report.append({**base, "Worksheet": sheet_spec, "Status": f"gagal: {error}", "Baris": 0, "Data per": None})
+        for sheet_name in sheet_names:
+            archived_after = worksheet_archive_cutoff(sheet_name)
+            futures[(store, sheet_name)] = (archived_after, executor.submit(
+                _get_dataset, (store_urls[store], sheet_name), dataset_store, sync_store, pool, archived_after
+            ))
+    wait([future for _, future in futures.values()], timeout=max(0.0, deadline - time.monotonic()))
+
+    datasets: Dict[Tuple[Optional[str], str], Dataset] = {}
+    for (store, sheet_name), (archived_after, future) in futures.items():
+        row = {**({"Toko": store} if store is not None else {}), "Worksheet": sheet_name}
+        if not future.done():
+            report.append({**row, "Status": "masih dimuat", "Baris": 0, "Data per": None})
+            continue
+        try:
+            dataset, entry = future.result()
+        except Exception as exc:
+            dataset, entry = None, {"error": str(exc)}
+        if dataset is None or dataset.frame.empty:
+            report.append({**row, "Status": f"gagal: {entry.get('error') or 'tidak ada data'}", "Baris": 0, "Data per": None})
+            continue
+        datasets[(store, sheet_name)] = dataset
+        if entry.get("refreshing"):
+            status = "memperbarui"
+        elif entry.get("error"):
+            status = "pembaruan gagal"
+        else:
+            status = "arsip" if is_archived_dataset(dataset, archived_after) else "ok"
+        report.append({**row, "Status": status, "Baris": len(dataset.frame), "Data per": dataset.fetched_at})
+    return datasets, report
+
+
+def _align_frames(frames: List[pd.DataFrame]) -> List[pd.DataFrame]:
+    # Samakan kolom dan tipe kategori antar sumber sebelum union_categoricals
+    columns = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+    frames = [frame.reindex(columns=columns) if list(frame.columns) != columns else frame for frame in frames]
+    for column in columns:
+        dtypes = [frame[column].dtype for frame in frames]
+        if any(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes) and len({
+            str(dtype.categories.dtype) if isinstance(dtype, pd.CategoricalDtype) else str(dtype) for dtype in dtypes
+        }) > 1:
+            frames = [frame.assign(**{column: frame[column].astype(str).astype("category")}) for frame in frames]
+    return frames
+
+
+def build_union(datasets: Dict[Tuple[Optional[str], str], Dataset]) -> Dataset:
+    # Gabungkan dataset per (toko, worksheet) dan bangun cube/indeksnya sekali
+    if len(datasets) == 1 and next(iter(datasets))[0] is None:
+        return next(iter(datasets.values()))
+    versions = tuple((key, dataset.version) for key, dataset in datasets.items())
+    key = hashlib.sha1(repr(versions).encode("utf-8")).hexdigest()[:16]
+    union_store = get_union_store()
+    with union_store["lock"]:
+        cached = union_store["entries"].get(key)
+        if cached is not None:
+            union_store["entries"].move_to_end(key)
+            return cached
+
+    frames = _align_frames([
+        dataset.frame if store is None else dataset.frame.assign(
+            Toko=pd.Categorical.from_codes(np.zeros(len(dataset.frame), dtype=np.int8), categories=[store])
+        )
+        for (store, _), dataset in datasets.items()
+    ])
+    combined = concat_compact(frames).reset_index(drop=True)
+    combined.attrs = {"version": f"gabungan-{key}"}
+    fetched = [dataset.fetched_at for dataset in datasets.values()]
+    sources = {dataset.source for dataset in datasets.values()}
+    union = build_dataset(combined, min(fetched), "sheet" if sources == {"sheet"} else "snapshot")
+    with union_store["lock"]:
+        union_store["entries"][key] = union
+        while len(union_store["entries"]) > 4:
+            union_store["entries"].popitem(last=False)
+    return union
+
+
+def get_combined_dataset(store_urls: Dict[Optional[str], str], sheet_spec: str) -> Tuple[Optional[Dataset], dict]:
+    datasets, report = load_source_datasets(store_urls, sheet_spec)
+    live = [row for row in report if row["Status"] != "arsip"]
+    status = {
+        "fetched_at": min((row["Data per"] for row in live if row["Data per"] is not None), default=None),
+        "refreshing": any(row["Status"] in ("memperbarui", "masih dimuat") for row in report),
+        "error": "; ".join(f"{source_label(row)} ({row['Status']})" for row in report if row["Status"].startswith("gagal")) or None,
+        "sources": report
+    }
+    if not datasets:
+        return None, status
+    return build_union(datasets), status
+
+
+def process_raw_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # Rename, parse, dan turunkan kolom dari frame mentah worksheet RekapSO
     df.dropna(axis=0, how="all", inplace=True)
     df.columns = df.columns.str.strip()
 
@@ -439,7 +1410,7 @@ def load_data(spreadsheet_url: str, sheet_name: str) -> Optional[pd.DataFrame]:
     if "PLU" not in df.columns:
         # Coba cari kolom dengan nama berbeda
         for col in df.columns:
-            if "PLU" in col.upper() or "ITEM" in col.upper() or "KODE" in col.upper():
+            if any(alias in col.upper() for alias in PLU_ALIASES):
                 df.rename(columns={col: "PLU"}, inplace=True)
                 break
     
@@ -448,36 +1419,11 @@ def load_data(spreadsheet_url: str, sheet_name: str) -> Optional[pd.DataFrame]:
         df["PLU"] = df.index.astype(str)
 
     if "Tanggal Stock Opname" not in df.columns:
-        st.error("Kolom 'Tanggal Stock Opname' tidak ditemukan pada sheet.")
-        return None
-
-    # PERBAIKAN 1: Konversi tanggal dengan berbagai format
-    def parse_date(date_str):
-        if pd.isna(date_str) or date_str == '' or date_str is None:
-            return pd.NaT
-            
-        # Coba berbagai format tanggal
-        date_formats = [
-            '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y',  # Format Indonesia
-            '%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d',  # Format ISO
-            '%m-%d-%Y', '%m/%d/%Y', '%m.%d.%Y',  # Format US
-            '%d-%b-%Y', '%d/%b/%Y', '%d.%b.%Y',  # Format dengan nama bulan
-            '%d-%B-%Y', '%d/%B/%Y', '%d.%B.%Y',  # Format dengan nama bulan panjang
-        ]
-        
-        for fmt in date_formats:
-            try:
-                return pd.to_datetime(date_str, format=fmt)
-            except (ValueError, TypeError):
-                continue
-        
-        # Jika semua format gagal, coba parsing otomatis
-        try:
-            return pd.to_datetime(date_str, infer_datetime_format=True, errors='coerce')
-        except (ValueError, TypeError):
-            return pd.NaT
+        raise ValueError("Kolom 'Tanggal Stock Opname' tidak ditemukan pada sheet.")
 
-    df["Tanggal Stock Opname"] = df["Tanggal Stock Opname"].apply(parse_date)
+    # PERBAIKAN 1: Konversi tanggal dengan berbagai format (vektor per format)
+    df["Tanggal Stock Opname"], date_report = parse_date_column(df["Tanggal Stock Opname"])
+    df.attrs["date_parse_report"] = date_report
 
     for kolom in ["Selisih Qty (Pcs)", "Selisih Value (Rp)"]:
         if kolom in df.columns:
@@ -503,44 +1449,146 @@ def load_data(spreadsheet_url: str, sheet_name: str) -> Optional[pd.DataFrame]:
 
     df["Varians Nilai Absolut"] = df["Selisih Value (Rp)"].abs()
     df["Varians Qty Absolut"] = df["Selisih Qty (Pcs)"].abs()
-    df["Arah Varians"] = df["Selisih Value (Rp)"].apply(
-        lambda val: "Positif" if val > 0 else ("Negatif" if val < 0 else "Netral")
+    value = df["Selisih Value (Rp)"].to_numpy(dtype="float64", na_value=np.nan)
+    df["Arah Varians"] = pd.Categorical(
+        np.select([value > 0, value < 0], ["Positif", "Negatif"], default="Netral"),
+        categories=["Positif", "Negatif", "Netral"]
     )
 
+    return compact_frame(df)
+
+
+def _narrow_numeric(series: pd.Series) -> pd.Series:
+    # int32 hanya bila aman: tanpa NaN, semua bulat, dan muat; selain itu tetap float64
+    # (float32 tidak dipakai karena total Rupiah butuh presisi penuh saat dijumlahkan)
+    values = series.to_numpy(dtype="float64", na_value=np.nan)
+    if (
+        values.size
+        and not np.isnan(values).any()
+        and np.array_equal(values, np.round(values))
+        and np.abs(values).max() <= np.iinfo(np.int32).max
+    ):
+        return series.astype("int32")
+    return series.astype("float64")
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # Skema ringkas: kategori untuk label, string Arrow untuk nama produk, angka dipersempit
+    before = int(df.memory_usage(deep=True).sum())
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    for column in ARROW_STRING_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype(pd.StringDtype("pyarrow"))
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            df[column] = _narrow_numeric(df[column])
+    df.attrs["memory_report"] = {
+        "sebelum": before,
+        "sesudah": int(df.memory_usage(deep=True).sum())
+    }
     return df
 
 
+def _align_categories(parts: List[pd.Series]) -> List[pd.Series]:
+    # Samakan dtype kategori sebelum union_categoricals
+    dtypes = [part.cat.categories.dtype for part in parts if len(part.cat.categories)]
+    if not dtypes:
+        return parts
+    if len({str(dtype) for dtype in dtypes}) == 1:
+        target = dtypes[0]
+    elif all(pd.api.types.is_numeric_dtype(dtype) for dtype in dtypes):
+        target = np.result_type(*dtypes)
+    else:
+        target = "str"
+    return [
+        part if str(part.cat.categories.dtype) == str(target)
+        else part.cat.rename_categories(part.cat.categories.astype(target))
+        for part in parts
+    ]
+
+
+def concat_compact(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    # pd.concat yang mempertahankan dtype kategori dengan menyatukan kategorinya
+    columns = frames[0].columns
+    categorical = [
+        column for column in columns
+        if all(column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames)
+    ]
+    result = pd.concat([frame.drop(columns=categorical) for frame in frames])
+    for column in categorical:
+        result[column] = union_categoricals(_align_categories([frame[column] for frame in frames]), ignore_order=True)
+    return result[list(columns)]
+
+
+# Fungsi st.cache_data menerima fingerprint view sebagai kunci; frame diberi awalan "_"
+# sehingga Streamlit tidak meng-hash seluruh isinya di setiap pemanggilan.
 @st.cache_data(ttl=600, show_spinner=False)
-def aggregate_tag_summary(df: pd.DataFrame) -> pd.DataFrame:
-    if df.empty:
+def aggregate_tag_summary(fingerprint: str, _cube: pd.DataFrame) -> pd.DataFrame:
+    cube = _cube
+    if cube.empty:
         return pd.DataFrame()
+    grouped = cube.groupby("Tag", observed=True)[["Selisih Value (Rp)", "Jumlah Nilai"]].sum()
     return (
-        df.groupby("Tag")["Selisih Value (Rp)"]
-        .agg(["sum", "mean", "count"])
-        .rename(columns={"sum": "Total Varians", "mean": "Rata-rata Varians", "count": "Jumlah PLU"})
+        pd.DataFrame({
+            "Total Varians": grouped["Selisih Value (Rp)"],
+            "Rata-rata Varians": grouped["Selisih Value (Rp)"] / grouped["Jumlah Nilai"],
+            "Jumlah PLU": grouped["Jumlah Nilai"]
+        })
         .sort_values(by="Total Varians", key=lambda x: x.abs(), ascending=False)
     )
 
 
 @st.cache_data(ttl=600, show_spinner=False)
-def detect_outliers_iqr(df: pd.DataFrame, column: str) -> pd.DataFrame:
+def iqr_stats(fingerprint: str, _df: pd.DataFrame, column: str) -> dict:
+    # Kuartil, pagar 1.5·IQR, ujung whisker dan sampel outlier dari satu lintasan percentile
+    if column not in _df.columns:
+        return {}
+    values = _df[column].to_numpy(dtype="float64", na_value=np.nan)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {}
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    lower_fence = q1 - 1.5 * iqr
+    upper_fence = q3 + 1.5 * iqr
+    inside = (values >= lower_fence) & (values <= upper_fence)
+    outliers = values[~inside]
+    if len(outliers) > BOX_MAX_OUTLIERS:
+        outliers = outliers[np.argsort(np.abs(outliers - median))[-BOX_MAX_OUTLIERS:]]
+    return {
+        "q1": float(q1),
+        "median": float(median),
+        "q3": float(q3),
+        "mean": float(values.mean()),
+        "lower_fence": float(lower_fence),
+        "upper_fence": float(upper_fence),
+        "whisker_low": float(values[inside].min()),
+        "whisker_high": float(values[inside].max()),
+        "outlier_count": int(len(values) - inside.sum()),
+        "outlier_sample": outliers
+    }
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def detect_outliers_iqr(fingerprint: str, _df: pd.DataFrame, column: str) -> pd.DataFrame:
+    df = _df
     if column not in df.columns or df.empty:
         return pd.DataFrame()
-    q1 = df[column].quantile(0.25)
-    q3 = df[column].quantile(0.75)
-    iqr = q3 - q1
-    lower_bound = q1 - 1.5 * iqr
-    upper_bound = q3 + 1.5 * iqr
-    outliers = df[(df[column] < lower_bound) | (df[column] > upper_bound)]
+    box_stats = iqr_stats(fingerprint, df, column)
+    if not box_stats:
+        return pd.DataFrame()
+    outliers = df[(df[column] < box_stats["lower_fence"]) | (df[column] > box_stats["upper_fence"])]
     return outliers.sort_values(by=column, ascending=False)
 
 
-def create_top_products_chart(df: pd.DataFrame, metric: str, top_n: int) -> go.Figure:
+def create_top_products_chart(cube: pd.DataFrame, metric: str, top_n: int) -> go.Figure:
     metric_column = "Selisih Value (Rp)" if metric == "Nilai (Rp)" else "Selisih Qty (Pcs)"
     label_metric = "Total Varians Nilai (Rp)" if metric == "Nilai (Rp)" else "Total Varians Kuantitas (Pcs)"
 
     top_products = (
-        df.groupby(["PLU", "Nama Produk"], dropna=False)[metric_column]
+        cube.groupby(["PLU", "Nama Produk"], dropna=False, observed=True)[metric_column]
         .sum()
         .to_frame("Varians")
         .assign(Varians_Absolut=lambda x: x["Varians"].abs())
@@ -581,11 +1629,11 @@ def create_top_products_chart(df: pd.DataFrame, metric: str, top_n: int) -> go.F
     return fig
 
 
-def create_trend_chart(df: pd.DataFrame, metric: str) -> go.Figure:
+def create_trend_chart(cube: pd.DataFrame, metric: str) -> go.Figure:
     metric_column = "Selisih Value (Rp)" if metric == "Nilai (Rp)" else "Selisih Qty (Pcs)"
     label_y = "Total Varians Nilai (Rp)" if metric == "Nilai (Rp)" else "Total Varians Kuantitas (Pcs)"
-    min_date = df["Tanggal Stock Opname"].min()
-    max_date = df["Tanggal Stock Opname"].max()
+    min_date = cube["Tanggal Stock Opname"].min()
+    max_date = cube["Tanggal Stock Opname"].max()
     
     if pd.isna(min_date) or pd.isna(max_date):
         fig = go.Figure()
@@ -609,7 +1657,7 @@ def create_trend_chart(df: pd.DataFrame, metric: str) -> go.Figure:
 
     if date_range < 45:
         trend_data = (
-            df.groupby(df["Tanggal Stock Opname"].dt.date)[metric_column]
+            cube.groupby(cube["Tanggal Stock Opname"].dt.date)[metric_column]
             .sum()
             .rename("Varians")
             .to_frame()
@@ -640,7 +1688,7 @@ def create_trend_chart(df: pd.DataFrame, metric: str) -> go.Figure:
         )
     else:
         trend_data = (
-            df.groupby(df["Tanggal Stock Opname"].dt.to_period("M"))[metric_column]
+            cube.groupby(cube["Tanggal Stock Opname"].dt.to_period("M"))[metric_column]
             .sum()
             .rename("Varians")
             .to_frame()
@@ -663,12 +1711,12 @@ def create_trend_chart(df: pd.DataFrame, metric: str) -> go.Figure:
     return fig
 
 
-def create_tag_analysis_chart(df: pd.DataFrame, metric: str) -> go.Figure:
+def create_tag_analysis_chart(cube: pd.DataFrame, metric: str) -> go.Figure:
     metric_column = "Selisih Value (Rp)" if metric == "Nilai (Rp)" else "Selisih Qty (Pcs)"
     label_metric = "Total Varians Nilai (Rp)" if metric == "Nilai (Rp)" else "Total Varians Kuantitas (Pcs)"
 
     tag_analysis = (
-        df.groupby("Tag")[metric_column]
+        cube.groupby("Tag", observed=True)[metric_column]
         .sum()
         .rename("Varians")
         .to_frame()
@@ -705,12 +1753,12 @@ def create_tag_analysis_chart(df: pd.DataFrame, metric: str) -> go.Figure:
     return fig
 
 
-def create_category_analysis_chart(df: pd.DataFrame, metric: str) -> go.Figure:
+def create_category_analysis_chart(cube: pd.DataFrame, metric: str) -> go.Figure:
     metric_column = "Selisih Value (Rp)" if metric == "Nilai (Rp)" else "Selisih Qty (Pcs)"
     label_metric = "Total Varians Nilai (Rp)" if metric == "Nilai (Rp)" else "Total Varians Kuantitas (Pcs)"
 
     category_analysis = (
-        df.groupby("Kategori")[metric_column]
+        cube.groupby("Kategori", observed=True)[metric_column]
         .sum()
         .rename("Varians")
         .to_frame()
@@ -762,47 +1810,208 @@ def create_scatter_chart(df: pd.DataFrame) -> go.Figure:
     
     # PERBAIKAN: Hapus nilai NaN sebelum membuat scatter plot
     scatter_df = df.dropna(subset=["Selisih Qty (Pcs)", "Selisih Value (Rp)"])
-    
-    fig = px.scatter(
-        scatter_df,
-        x="Selisih Qty (Pcs)",
-        y="Selisih Value (Rp)",
-        hover_data=["PLU", "Nama Produk", "Tag"],
-        color="Tag",
-        color_discrete_sequence=PLOTLY_COLORWAY,
-        title="<b>Varians Kuantitas vs Nilai</b>",
-        trendline="ols" if len(scatter_df) > 10 else None,
-        height=520
-    )
+
+    if len(scatter_df) > SCATTER_DENSITY_ROWS:
+        fig = create_scatter_density_chart(scatter_df)
+    else:
+        fig = px.scatter(
+            scatter_df,
+            x="Selisih Qty (Pcs)",
+            y="Selisih Value (Rp)",
+            hover_data=["PLU", "Nama Produk", "Tag"],
+            color="Tag",
+            color_discrete_sequence=PLOTLY_COLORWAY,
+            title="<b>Varians Kuantitas vs Nilai</b>",
+            render_mode="webgl" if len(scatter_df) > SCATTER_WEBGL_ROWS else "svg",
+            height=520
+        )
+        # Garis tren OLS per Tag, setara trendline="ols" tanpa statsmodels
+        for trace in list(fig.data):
+            add_ols_trendline(fig, np.asarray(trace.x, dtype="float64"), np.asarray(trace.y, dtype="float64"),
+                              color=trace.marker.color, name=trace.name, legendgroup=trace.legendgroup)
     fig.update_layout(title_x=0.5)
     fig.add_hline(y=0, line_width=1, line_color="rgba(148,163,184,0.32)", line_dash="dot")
     fig.add_vline(x=0, line_width=1, line_color="rgba(148,163,184,0.32)", line_dash="dot")
     return fig
 
 
-def create_treemap_chart(df: pd.DataFrame) -> go.Figure:
-    if df.empty:
-        fig = go.Figure()
-        fig.add_annotation(
-            text="Tidak ada data untuk treemap.",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5,
-            showarrow=False,
-            font=dict(color="#CBD5F5", size=16)
+def fit_ols_line(x: np.ndarray, y: np.ndarray) -> Optional[Tuple[float, float]]:
+    # Slope dan intercept OLS bentuk tertutup; None jika data terlalu sedikit atau x konstan
+    if len(x) <= 10:
+        return None
+    x_mean = x.mean()
+    y_mean = y.mean()
+    x_centered = x - x_mean
+    sxx = float(np.dot(x_centered, x_centered))
+    if sxx == 0:
+        return None
+    slope = float(np.dot(x_centered, y - y_mean)) / sxx
+    return slope, float(y_mean - slope * x_mean)
+
+
+def add_ols_trendline(fig: go.Figure, x: np.ndarray, y: np.ndarray, color=None, name: str = "", legendgroup=None) -> None:
+    line = fit_ols_line(x, y)
+    if line is None:
+        return
+    slope, intercept = line
+    x_ends = np.array([x.min(), x.max()])
+    fig.add_trace(
+        go.Scatter(
+            x=x_ends,
+            y=intercept + slope * x_ends,
+            mode="lines",
+            line=dict(color=color, width=2),
+            name=f"Tren OLS {name}".strip(),
+            legendgroup=legendgroup,
+            showlegend=False,
+            hovertemplate=f"y = {slope:,.2f}x + {intercept:,.0f}<extra>{name}</extra>"
         )
-        fig.update_layout(title="<b>Treemap Varians</b>", title_x=0.5)
-        return fig
-    
-    # PERBAIKAN UTAMA: Filter data untuk menghindari error ZeroDivisionError
-    # Hapus baris dengan Varians Nilai Absolut = 0 atau NaN
-    treemap_df = df.copy()
-    treemap_df = treemap_df[treemap_df["Varians Nilai Absolut"] > 0]
-    treemap_df = treemap_df.dropna(subset=["Varians Nilai Absolut", "Selisih Value (Rp)", "Tag", "Nama Produk"])
-    
-    if treemap_df.empty:
+    )
+
+
+def create_scatter_density_chart(scatter_df: pd.DataFrame) -> go.Figure:
+    # Kepadatan qty vs nilai hasil np.histogram2d; titik di luar pagar IQR tetap individual
+    x = scatter_df["Selisih Qty (Pcs)"].to_numpy(dtype="float64")
+    y = scatter_df["Selisih Value (Rp)"].to_numpy(dtype="float64")
+
+    def fences(values: np.ndarray) -> Tuple[float, float]:
+        q1, q3 = np.percentile(values, [25, 75])
+        iqr = q3 - q1
+        return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+    (x_low, x_high), (y_low, y_high) = fences(x), fences(y)
+    inside = (x >= x_low) & (x <= x_high) & (y >= y_low) & (y <= y_high)
+
+    counts, x_edges, y_edges = np.histogram2d(
+        x[inside], y[inside],
+        bins=SCATTER_DENSITY_BINS,
+        range=[[x_low, x_high if x_high > x_low else x_low + 1], [y_low, y_high if y_high > y_low else y_low + 1]]
+    )
+    fig = go.Figure()
+    fig.add_trace(
+        go.Heatmap(
+            x=(x_edges[:-1] + x_edges[1:]) / 2,
+            y=(y_edges[:-1] + y_edges[1:]) / 2,
+            z=np.where(counts.T > 0, np.log10(counts.T + 1), np.nan),
+            customdata=counts.T,
+            colorscale="Viridis",
+            colorbar=dict(title="log10(baris)"),
+            hovertemplate="Qty: %{x:,.0f}<br>Nilai: %{y:,.0f}<br>Baris: %{customdata:,.0f}<extra></extra>",
+            name="Kepadatan"
+        )
+    )
+
+    outlier_positions = np.flatnonzero(~inside)
+    if len(outlier_positions) > SCATTER_MAX_OUTLIERS:
+        magnitude = np.abs(y[outlier_positions])
+        outlier_positions = outlier_positions[np.argsort(magnitude)[-SCATTER_MAX_OUTLIERS:]]
+    outliers = scatter_df.iloc[outlier_positions]
+    fig.add_trace(
+        go.Scattergl(
+            x=x[outlier_positions],
+            y=y[outlier_positions],
+            mode="markers",
+            marker=dict(color="#FB7185", size=5, opacity=0.8),
+            customdata=np.column_stack([
+                outliers["PLU"].astype(str).to_numpy(),
+                outliers["Nama Produk"].astype(str).to_numpy() if "Nama Produk" in outliers.columns
+                else np.full(len(outliers), ""),
+                outliers["Tag"].astype(str).to_numpy()
+            ]) if len(outliers) else None,
+            hovertemplate="PLU %{customdata[0]} • %{customdata[1]}<br>Tag %{customdata[2]}<br>"
+                          "Qty: %{x:,.0f}<br>Nilai: %{y:,.0f}<extra>Outlier</extra>",
+            name=f"Outlier ({len(outlier_positions):,} titik)"
+        )
+    )
+    add_ols_trendline(fig, x, y, color="#FACC15", name="semua")
+    fig.update_layout(
+        title=f"<b>Varians Kuantitas vs Nilai</b> <sup>(kepadatan {len(scatter_df):,} baris)</sup>",
+        xaxis_title="Selisih Qty (Pcs)",
+        yaxis_title="Selisih Value (Rp)",
+        height=520
+    )
+    return fig
+
+
+def _bucket_top_k(leaf: pd.DataFrame, parents: List[str], column: str, k: int) -> pd.DataFrame:
+    # Ganti nilai `column` di luar top-k per induk (berdasar varians absolut) dengan "Lainnya"
+    totals = leaf.groupby(parents + [column], sort=False)["abs"].sum().reset_index()
+    ranks = totals.groupby(parents)["abs"] if parents else totals["abs"]
+    totals["rank"] = ranks.rank(method="first", ascending=False)
+    kept = totals.loc[totals["rank"] <= k, parents + [column]].assign(_kept=True)
+    flags = leaf[parents + [column]].merge(kept, on=parents + [column], how="left")["_kept"]
+    return leaf.assign(**{column: np.where(flags.notna().to_numpy(), leaf[column], OTHERS_LABEL)})
+
+
+def build_treemap_hierarchy(cube: pd.DataFrame, top_k: Optional[Dict[str, int]] = None) -> pd.DataFrame:
+    # Node treemap Kategori → Tag → PLU dari cube (PLU dijumlah lintas tanggal)
+    top_k = {**TREEMAP_TOP_K, **(top_k or {})}
+    grouped = (
+        cube.groupby(["Kategori", "Tag", "PLU"], observed=True, dropna=False)
+        .agg(
+            abs=("Varians Nilai Absolut", "sum"),
+            signed=("Selisih Value (Rp)", "sum"),
+            name=("Nama Produk", "first")
+        )
+        .reset_index()
+    )
+    # Nilai dibulatkan ke rupiah agar jumlah anak selalu tepat sama dengan induk (branchvalues="total")
+    grouped["abs"] = grouped["abs"].astype("float64").round()
+    grouped = grouped[grouped["abs"] > 0]
+    if grouped.empty:
+        return pd.DataFrame(columns=["ids", "parents", "labels", "values", "colors"])
+
+    leaf = pd.DataFrame({
+        "Kategori": grouped["Kategori"].astype(str).to_numpy(),
+        "Tag": grouped["Tag"].astype(str).to_numpy(),
+        "PLU": grouped["PLU"].astype(str).to_numpy(),
+        "name": grouped["name"].astype(str).to_numpy(),
+        "abs": grouped["abs"].to_numpy(),
+        "signed": grouped["signed"].astype("float64").to_numpy()
+    })
+    leaf = _bucket_top_k(leaf, [], "Kategori", top_k["Kategori"])
+    leaf = _bucket_top_k(leaf, ["Kategori"], "Tag", top_k["Tag"])
+    leaf = _bucket_top_k(leaf, ["Kategori", "Tag"], "PLU", top_k["PLU"])
+
+    products = (
+        leaf.groupby(["Kategori", "Tag", "PLU"], sort=False)
+        .agg(values=("abs", "sum"), colors=("signed", "sum"), name=("name", "first"), count=("abs", "size"))
+        .reset_index()
+    )
+    tags = products.groupby(["Kategori", "Tag"], sort=False).agg(values=("values", "sum"), colors=("colors", "sum")).reset_index()
+    categories = tags.groupby("Kategori", sort=False).agg(values=("values", "sum"), colors=("colors", "sum")).reset_index()
+
+    tag_ids = tags["Kategori"] + "/" + tags["Tag"]
+    product_ids = products["Kategori"] + "/" + products["Tag"] + "/" + products["PLU"]
+    product_labels = np.where(
+        products["PLU"] == OTHERS_LABEL,
+        OTHERS_LABEL + " (" + products["count"].astype(str) + " PLU)",
+        products["PLU"] + " - " + products["name"]
+    )
+    return pd.concat([
+        pd.DataFrame({
+            "ids": categories["Kategori"], "parents": "", "labels": categories["Kategori"],
+            "values": categories["values"], "colors": categories["colors"]
+        }),
+        pd.DataFrame({
+            "ids": tag_ids, "parents": tags["Kategori"], "labels": tags["Tag"],
+            "values": tags["values"], "colors": tags["colors"]
+        }),
+        pd.DataFrame({
+            "ids": product_ids,
+            "parents": products["Kategori"] + "/" + products["Tag"],
+            "labels": product_labels,
+            "values": products["values"], "colors": products["colors"]
+        })
+    ], ignore_index=True)
+
+
+def create_treemap_chart(cube: pd.DataFrame, top_k: Optional[Dict[str, int]] = None) -> go.Figure:
+    nodes = build_treemap_hierarchy(cube, top_k) if not cube.empty else pd.DataFrame()
+    if nodes.empty:
         fig = go.Figure()
         fig.add_annotation(
-            text="Tidak ada data varians positif untuk treemap.",
+            text="Tidak ada data varians untuk treemap.",
             xref="paper", yref="paper",
             x=0.5, y=0.5,
             showarrow=False,
@@ -810,65 +2019,315 @@ def create_treemap_chart(df: pd.DataFrame) -> go.Figure:
         )
         fig.update_layout(title="<b>Treemap Varians</b>", title_x=0.5)
         return fig
-    
-    # PERBAIKAN: Tambahkan handling untuk nilai yang terlalu kecil
-    # Pastikan tidak ada nilai nol pada Varians Nilai Absolut
-    treemap_df["Varians Nilai Absolut"] = treemap_df["Varians Nilai Absolut"].clip(lower=1e-9)
-    
-    # Batasi jumlah data untuk performa yang lebih baik
-    if len(treemap_df) > 1000:
-        treemap_df = treemap_df.nlargest(1000, "Varians Nilai Absolut")
-    
-    # PERBAIKAN: Tambahkan kolom ID unik untuk setiap produk
-    treemap_df["Produk_ID"] = treemap_df["PLU"].astype(str) + " - " + treemap_df["Nama Produk"]
-    
-    fig = px.treemap(
-        treemap_df,
-        path=["Tag", "Produk_ID"],  # PERBAIKAN: Gunakan Produk_ID yang unik
-        values="Varians Nilai Absolut",
-        color="Selisih Value (Rp)",
-        color_continuous_scale=[COLOR_NEGATIVE, "#94A3B8", COLOR_SUCCESS],
-        color_continuous_midpoint=0,
-        title="<b>Treemap Varians Nilai per Tag & Produk</b>",
-        height=520
+
+    fig = go.Figure(
+        go.Treemap(
+            ids=nodes["ids"],
+            parents=nodes["parents"],
+            labels=nodes["labels"],
+            values=nodes["values"],
+            branchvalues="total",
+            marker=dict(
+                colors=nodes["colors"],
+                colorscale=[COLOR_NEGATIVE, "#94A3B8", COLOR_SUCCESS],
+                cmid=0,
+                colorbar=dict(title="Selisih Value (Rp)")
+            ),
+            textinfo="label+value",
+            hovertemplate="<b>%{label}</b><br>Varians: %{value}<br>Nilai: %{color}<extra></extra>"
+        )
     )
-    fig.update_layout(title_x=0.5, margin=dict(t=80, l=30, r=30, b=30))
-    
-    # PERBAIKAN: Tambahkan custom data aggregation untuk menghindari error
-    fig.update_traces(
-        textinfo="label+value",
-        hovertemplate="<b>%{label}</b><br>Varians: %{value}<br>Nilai: %{color}<extra></extra>"
+    fig.update_layout(
+        title="<b>Treemap Varians Nilai per Kategori, Tag & Produk</b>",
+        title_x=0.5,
+        height=520,
+        margin=dict(t=80, l=30, r=30, b=30)
     )
-    
     return fig
 
 
 def filter_dataframe(
-    df: pd.DataFrame,
+    index: FilterIndex,
     date_range: Tuple[datetime, datetime],
     selected_tags: List[str],
-    selected_direction: List[str]
+    selected_direction: List[str],
+    selected_stores: Optional[List[str]] = None
 ) -> pd.DataFrame:
-    filtered = df.copy()
-    if isinstance(date_range, tuple) and len(date_range) == 2:
-        start_date, end_date = date_range
-    else:
-        start_date = end_date = date_range[0] if date_range else datetime.today()
+    return index.select(date_range, selected_tags, selected_direction, selected_stores)
 
-    start_ts = pd.to_datetime(start_date)
-    end_ts = pd.to_datetime(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
-    filtered = filtered[
-        (filtered["Tanggal Stock Opname"] >= start_ts) &
-        (filtered["Tanggal Stock Opname"] <= end_ts)
-    ]
 
-    if selected_tags and "Semua" not in selected_tags:
-        filtered = filtered[filtered["Tag"].isin(selected_tags)]
+def normalize_filter_spec(
+    date_range: Tuple[datetime, datetime],
+    selected_tags: List[str],
+    selected_direction: List[str],
+    selected_stores: Optional[List[str]] = None
+) -> tuple:
+    # Bentuk kanonik filter sidebar: urutan pilihan dan "Semua" tidak mengubah kunci
+    def normalize(selected: List[str]) -> Tuple[str, ...]:
+        if not selected or "Semua" in selected:
+            return ("Semua",)
+        return tuple(sorted(str(value) for value in selected))
+
+    start_ts, end_ts = _date_bounds(date_range)
+    return (
+        start_ts,
+        end_ts,
+        normalize(selected_tags),
+        normalize(selected_direction),
+        normalize(selected_stores)
+    )
+
+
+def filter_fingerprint(version: str, spec: tuple) -> str:
+    # Token ringkas dan immutable untuk (versi dataset, filter); kunci semua cache analitik
+    return hashlib.sha1(repr((version, spec)).encode("utf-8")).hexdigest()[:16]
+
+
+class FilterView:
+    # Hasil filter untuk satu (versi dataset, filter) beserta memo agregat turunannya
+
+    def __init__(self, frame: pd.DataFrame, cube: pd.DataFrame, fingerprint: str, spec: tuple):
+        self.frame = frame
+        self.cube = cube
+        self.fingerprint = fingerprint
+        self.spec = spec
+        self._memo: Dict[str, object] = {}
+
+    def derive(self, name: str, compute):
+        # Hitung agregat sekali per view; sesi lain dengan filter sama memakai hasilnya
+        try:
+            return self._memo[name]
+        except KeyError:
+            return self._memo.setdefault(name, compute())
+
+
+class FilterCache:
+    # LRU terbatas berisi FilterView, dibagi oleh semua sesi di proses ini
+
+    def __init__(self, maxsize: int = FILTER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, FilterView]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, build) -> FilterView:
+        with self._lock:
+            view = self._entries.get(key)
+            if view is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return view
+            self.misses += 1
+        view = build()
+        with self._lock:
+            view = self._entries.setdefault(key, view)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return view
+
+    def usage(self) -> dict:
+        with self._lock:
+            return {"hit": self.hits, "miss": self.misses, "entri": len(self._entries)}
+
+
+@st.cache_resource(show_spinner=False)
+def get_filter_cache() -> FilterCache:
+    return FilterCache()
+
+
+def get_filter_view(
+    dataset: "Dataset",
+    date_range: Tuple[datetime, datetime],
+    selected_tags: List[str],
+    selected_direction: List[str],
+    selected_stores: Optional[List[str]] = None
+) -> FilterView:
+    spec = normalize_filter_spec(date_range, selected_tags, selected_direction, selected_stores)
+    fingerprint = filter_fingerprint(dataset.version, spec)
+    selection = (date_range, selected_tags, selected_direction, selected_stores)
+    return get_filter_cache().get(
+        fingerprint,
+        lambda: FilterView(
+            filter_dataframe(dataset.index, *selection),
+            filter_dataframe(dataset.cube_index, *selection),
+            fingerprint,
+            spec
+        )
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_session_registry() -> dict:
+    # Sesi aktif di proses ini (token → terakhir terlihat) beserta sampel RSS per sesi baru
+    return {"lock": threading.Lock(), "sessions": {}, "total": 0, "samples": []}
+
+
+def process_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def track_session(dataset: "Dataset") -> dict:
+    # Catat sesi ini; setiap sesi baru menambah sampel (jumlah sesi, RSS, versi dataset)
+    session_token = st.session_state.setdefault("session_token", uuid.uuid4().hex)
+    registry = get_session_registry()
+    now = time.time()
+    with registry["lock"]:
+        sessions = registry["sessions"]
+        for token in [token for token, seen in sessions.items() if now - seen >= DATA_TTL_SECONDS]:
+            del sessions[token]
+        is_new = session_token not in sessions
+        sessions[session_token] = now
+        if is_new:
+            registry["total"] += 1
+            registry["samples"].append({
+                "Sesi": registry["total"],
+                "RSS (MB)": round((process_rss_bytes() or 0) / 1024 ** 2, 1),
+                "Versi Dataset": dataset.version,
+            })
+            del registry["samples"][:-20]
+        return {"active": len(sessions), "samples": list(registry["samples"])}
+
+
+def measure_hash_cost(view: FilterView, repeats: int = 3) -> dict:
+    # Bandingkan biaya meng-hash isi frame (cara st.cache_data) dengan fingerprint view
+    start = time.perf_counter()
+    for _ in range(repeats):
+        pd.util.hash_pandas_object(view.frame).sum()
+        pd.util.hash_pandas_object(view.cube).sum()
+    frame_ms = (time.perf_counter() - start) * 1000 / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        hashlib.md5(view.fingerprint.encode("utf-8")).hexdigest()
+    token_ms = (time.perf_counter() - start) * 1000 / repeats
+    return {"frame_ms": frame_ms, "token_ms": token_ms}
+
+
+def _prune_exports() -> None:
+    cutoff = time.time() - EXPORT_MAX_AGE_SECONDS
+    for path in EXPORT_DIR.glob("*"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
+
 
-    if selected_direction and "Semua" not in selected_direction:
-        filtered = filtered[filtered["Arah Varians"].isin(selected_direction)]
+def _iter_chunks(df: pd.DataFrame):
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        yield start, df.iloc[start:start + EXPORT_CHUNK_ROWS]
 
-    return filtered
+
+def _write_csv(df: pd.DataFrame, path: Path) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as handle:
+        for start, chunk in _iter_chunks(df):
+            chunk.to_csv(handle, header=start == 0, index=False, date_format="%Y-%m-%d")
+
+
+def _write_parquet(df: pd.DataFrame, path: Path) -> None:
+    writer = None
+    try:
+        for _, chunk in _iter_chunks(df):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path)
+
+
+def _excel_column_values(series: pd.Series) -> list:
+    missing = series.isna().to_numpy()
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = ((series - pd.Timestamp(SHEETS_EPOCH)) / pd.Timedelta(days=1)).astype("float64")
+    elif pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+        values = series.astype("float64")
+    else:
+        values = series.astype(str)
+    values = values.to_numpy(dtype=object)
+    values[missing] = None
+    return values.tolist()
+
+
+def _write_excel(df: pd.DataFrame, cube: pd.DataFrame, path: Path) -> None:
+    # Workbook mode constant_memory: baris ditulis berurutan dan langsung di-flush ke disk
+    workbook = xlsxwriter.Workbook(str(path), {
+        "constant_memory": True,
+        "nan_inf_to_errors": True,
+        "strings_to_formulas": False,
+        "strings_to_urls": False
+    })
+    try:
+        bold = workbook.add_format({"bold": True})
+        money = workbook.add_format({"num_format": "#,##0"})
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+
+        summary = workbook.add_worksheet("Ringkasan")
+        row = 0
+        for dimension in ("Tag", "Kategori"):
+            if dimension not in cube.columns:
+                continue
+            grouped = cube.groupby(dimension, observed=True)[
+                ["Selisih Qty (Pcs)", "Selisih Value (Rp)", "Varians Nilai Absolut", "Jumlah Nilai"]
+            ].sum()
+            summary.write_row(row, 0, [dimension, "Selisih Qty (Pcs)", "Selisih Value (Rp)", "Varians Nilai Absolut", "Jumlah Baris"], bold)
+            row += 1
+            for label, values in grouped.iterrows():
+                summary.write(row, 0, str(label))
+                for offset, value in enumerate(values.tolist(), start=1):
+                    summary.write_number(row, offset, float(value), money)
+                row += 1
+            row += 1
+        exported_rows = min(len(df), EXCEL_MAX_ROWS)
+        if exported_rows < len(df):
+            summary.write(row, 0, f"Sheet Data dipotong ke {exported_rows:,} dari {len(df):,} baris; gunakan ekspor CSV/Parquet untuk data lengkap.")
+
+        data = workbook.add_worksheet("Data")
+        for position, column in enumerate(df.columns):
+            if pd.api.types.is_datetime64_any_dtype(df[column]):
+                # Format kolom berlaku untuk serial tanggal yang ditulis tanpa format sel
+                data.set_column(position, position, 12, date_format)
+        data.write_row(0, 0, list(df.columns), bold)
+        row = 1
+        for _, chunk in _iter_chunks(df.iloc[:exported_rows]):
+            # Konversi per kolom secara vektor, lalu satu write_row per baris; None = sel kosong
+            for values in zip(*(_excel_column_values(chunk[column]) for column in chunk.columns)):
+                data.write_row(row, 0, values)
+                row += 1
+    finally:
+        workbook.close()
+
+
+EXPORT_WRITERS = {
+    "csv": lambda view, path: _write_csv(view.frame, path),
+    "parquet": lambda view, path: _write_parquet(view.frame, path),
+    "xlsx": lambda view, path: _write_excel(view.frame, view.cube, path),
+}
+
+
+def export_view(view: FilterView, file_format: str) -> bytes:
+    # File ekspor untuk kondisi filter ini; dibuat sekali per fingerprint lalu dipakai ulang
+    path = EXPORT_DIR / f"{view.fingerprint}.{file_format}"
+    if not path.exists():
+        EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+        _prune_exports()
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            EXPORT_WRITERS[file_format](view, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+    return path.read_bytes()
 
 
 def render_insight_card(title: str, value: str, description: str, icon: str = "✨") -> None:
@@ -884,14 +2343,86 @@ def render_insight_card(title: str, value: str, description: str, icon: str = "
     )
 
 
-def highlight_insights(df: pd.DataFrame) -> None:
-    if df.empty:
+@dataclass(frozen=True)
+class KpiSummary:
+    total_qty: float
+    total_value: float
+    positive_qty: float
+    negative_qty: float
+    positive_value: float
+    negative_value: float
+    positive_count: int
+    negative_count: int
+    total_plu: int
+    # Posisi baris (iloc) varians nilai positif terbesar / negatif terbesar, None jika tidak ada
+    max_value_row: Optional[int]
+    min_value_row: Optional[int]
+
+    @property
+    def avg_value_per_plu(self) -> float:
+        # PERBAIKAN: Hindari pembagian nol
+        return self.total_value / self.total_plu if self.total_plu > 0 else 0
+
+
+def _signed_sums(values: np.ndarray) -> Tuple[float, float, float]:
+    # Total, jumlah positif dan jumlah negatif dalam satu reduksi per kolom
+    total = float(values.sum())
+    positive = float(np.maximum(values, 0).sum())
+    return total, positive, total - positive
+
+
+def compute_kpis(df: pd.DataFrame) -> KpiSummary:
+    # Semua angka Ringkasan Eksekutif dan kartu insight dari satu lintasan numpy
+    value = df["Selisih Value (Rp)"].to_numpy(dtype="float64", na_value=np.nan)
+    qty = df["Selisih Qty (Pcs)"].to_numpy(dtype="float64", na_value=np.nan)
+    value = np.where(np.isnan(value), 0.0, value)
+    qty = np.where(np.isnan(qty), 0.0, qty)
+
+    total_value, positive_value, negative_value = _signed_sums(value)
+    total_qty, positive_qty, negative_qty = _signed_sums(qty)
+    positive_count = int(np.count_nonzero(value > 0))
+    negative_count = int(np.count_nonzero(value < 0))
+
+    plu = df["PLU"]
+    if isinstance(plu.dtype, pd.CategoricalDtype):
+        codes = plu.cat.codes.to_numpy()
+        codes = codes[codes >= 0]
+        total_plu = int(np.count_nonzero(np.bincount(codes, minlength=len(plu.cat.categories))))
+    else:
+        total_plu = int(plu.nunique())
+
+    return KpiSummary(
+        total_qty=total_qty,
+        total_value=total_value,
+        positive_qty=positive_qty,
+        negative_qty=negative_qty,
+        positive_value=positive_value,
+        negative_value=negative_value,
+        positive_count=positive_count,
+        negative_count=negative_count,
+        total_plu=total_plu,
+        max_value_row=int(np.argmax(value)) if positive_count else None,
+        min_value_row=int(np.argmin(value)) if negative_count else None
+    )
+
+
+def compute_insights(view: FilterView) -> dict:
+    return {
+        "tag_summary": aggregate_tag_summary(view.fingerprint, view.cube),
+        "outliers_value": detect_outliers_iqr(view.fingerprint, view.frame, "Selisih Value (Rp)"),
+    }
+
+
+def highlight_insights(view: FilterView) -> None:
+    if view.frame.empty:
         return
 
-    tag_summary = aggregate_tag_summary(df)
-    biggest_positive = df[df["Selisih Value (Rp)"] > 0].sort_values("Selisih Value (Rp)", ascending=False).head(1)
-    biggest_negative = df[df["Selisih Value (Rp)"] < 0].sort_values("Selisih Value (Rp)").head(1)
-    outliers_value = detect_outliers_iqr(df, "Selisih Value (Rp)")
+    kpis = view.derive("kpis", lambda: compute_kpis(view.frame))
+    insights = view.derive("insights", lambda: compute_insights(view))
+    tag_summary = insights["tag_summary"]
+    biggest_positive = view.frame.iloc[[kpis.max_value_row]] if kpis.max_value_row is not None else view.frame.iloc[:0]
+    biggest_negative = view.frame.iloc[[kpis.min_value_row]] if kpis.min_value_row is not None else view.frame.iloc[:0]
+    outliers_value = insights["outliers_value"]
     outlier_count = len(outliers_value)
 
     col1, col2 = st.columns(2, gap="large")
@@ -974,7 +2505,7 @@ def highlight_insights(df: pd.DataFrame) -> None:
 # =========================================================
 # ------------------- FUNGSI DATA PROFILING -----------------
 # =========================================================
-def create_distribution_chart(df: pd.DataFrame, column: str) -> go.Figure:
+def create_distribution_chart(df: pd.DataFrame, column: str, scale: str = "linear") -> go.Figure:
     if column not in df.columns or df[column].isna().all():
         fig = go.Figure()
         fig.add_annotation(
@@ -987,22 +2518,29 @@ def create_distribution_chart(df: pd.DataFrame, column: str) -> go.Figure:
         fig.update_layout(title=f"<b>Distribusi {column}</b>", title_x=0.5)
         return fig
     
+    binned = bin_histogram(df[column].to_numpy(dtype="float64", na_value=np.nan), scale=scale)
+    to_axis = _symlog if scale == "symlog" else (lambda value: value)
+    axis_edges = binned["axis_edges"]
+
     fig = go.Figure()
     
-    # Histogram
-    fig.add_trace(go.Histogram(
-        x=df[column].dropna(),
-        nbinsx=30,
+    # Histogram: hanya tepi bin dan hitungan yang dikirim ke browser
+    fig.add_trace(go.Bar(
+        x=(axis_edges[:-1] + axis_edges[1:]) / 2,
+        y=binned["counts"],
+        width=np.diff(axis_edges),
+        customdata=np.column_stack([binned["edges"][:-1], binned["edges"][1:]]),
+        hovertemplate="%{customdata[0]:,.0f} – %{customdata[1]:,.0f}<br>Frekuensi: %{y:,}<extra></extra>",
         name='Distribusi',
         marker_color=COLOR_PRIMARY,
         opacity=0.7
     ))
     
     # Mean line
-    mean_val = df[column].mean()
+    mean_val = binned["mean"]
     if not pd.isna(mean_val):
         fig.add_vline(
-            x=mean_val, 
+            x=to_axis(mean_val), 
             line_width=2, 
             line_dash="dash", 
             line_color=COLOR_ACCENT,
@@ -1011,10 +2549,10 @@ def create_distribution_chart(df: pd.DataFrame, column: str) -> go.Figure:
         )
     
     # Median line
-    median_val = df[column].median()
+    median_val = binned["median"]
     if not pd.isna(median_val):
         fig.add_vline(
-            x=median_val, 
+            x=to_axis(median_val), 
             line_width=2, 
             line_dash="dash", 
             line_color=COLOR_WARNING,
@@ -1024,16 +2562,49 @@ def create_distribution_chart(df: pd.DataFrame, column: str) -> go.Figure:
     
     fig.update_layout(
         title=f"<b>Distribusi {column}</b>",
-        xaxis_title=column,
+        xaxis_title=f"{column} (symlog)" if scale == "symlog" else column,
         yaxis_title="Frekuensi",
         title_x=0.5,
-        showlegend=False
+        showlegend=False,
+        bargap=0
     )
+    if scale == "symlog":
+        ticks = _symlog_ticks(binned["edges"][0], binned["edges"][-1])
+        fig.update_xaxes(tickvals=_symlog(ticks), ticktext=[format_quantity(tick) for tick in ticks])
     
     return fig
 
-def create_box_plot(df: pd.DataFrame, column: str) -> go.Figure:
-    if column not in df.columns or df[column].isna().all():
+
+def _symlog(values):
+    return np.sign(values) * np.log10(1 + np.abs(values))
+
+
+def _symlog_inverse(values):
+    return np.sign(values) * (10 ** np.abs(values) - 1)
+
+
+def _symlog_ticks(low: float, high: float) -> np.ndarray:
+    powers = 10.0 ** np.arange(0, int(np.ceil(np.log10(max(abs(low), abs(high), 1)))) + 1)
+    ticks = np.concatenate([-powers[::-1], [0.0], powers])
+    return ticks[(ticks >= low) & (ticks <= high)]
+
+
+def bin_histogram(values: np.ndarray, bins: int = HISTOGRAM_BINS, scale: str = "linear") -> dict:
+    # Binning sisi server dalam satu np.histogram, beserta mean dan median dari array yang sama
+    values = values[~np.isnan(values)]
+    axis_values = _symlog(values) if scale == "symlog" else values
+    counts, axis_edges = np.histogram(axis_values, bins=bins)
+    return {
+        "counts": counts,
+        "axis_edges": axis_edges,
+        "edges": _symlog_inverse(axis_edges) if scale == "symlog" else axis_edges,
+        "mean": float(values.mean()),
+        "median": float(np.median(values))
+    }
+
+
+def create_box_plot(box_stats: dict, column: str) -> go.Figure:
+    if not box_stats:
         fig = go.Figure()
         fig.add_annotation(
             text=f"Kolom '{column}' tidak tersedia atau semua nilai kosong.",
@@ -1047,15 +2618,37 @@ def create_box_plot(df: pd.DataFrame, column: str) -> go.Figure:
     
     fig = go.Figure()
     
+    # Statistik sudah dihitung di server; browser hanya menggambar kotaknya
     fig.add_trace(go.Box(
-        y=df[column].dropna(),
+        x=[column],
+        q1=[box_stats["q1"]],
+        median=[box_stats["median"]],
+        q3=[box_stats["q3"]],
+        mean=[box_stats["mean"]],
+        lowerfence=[box_stats["whisker_low"]],
+        upperfence=[box_stats["whisker_high"]],
         name=column,
-        marker_color=COLOR_PRIMARY,
-        boxpoints='outliers'
+        marker_color=COLOR_PRIMARY
     ))
     
+    outlier_sample = box_stats["outlier_sample"]
+    if len(outlier_sample):
+        fig.add_trace(go.Scatter(
+            x=[column] * len(outlier_sample),
+            y=outlier_sample,
+            mode="markers",
+            marker=dict(color=COLOR_PRIMARY, size=5, opacity=0.7),
+            name="Outlier",
+            hovertemplate="%{y:,.0f}<extra>Outlier</extra>"
+        ))
+    
+    shown = len(outlier_sample)
+    subtitle = (
+        f" <sup>({shown:,} dari {box_stats['outlier_count']:,} outlier ditampilkan)</sup>"
+        if shown < box_stats["outlier_count"] else ""
+    )
     fig.update_layout(
-        title=f"<b>Box Plot {column}</b>",
+        title=f"<b>Box Plot {column}</b>{subtitle}",
         yaxis_title=column,
         title_x=0.5,
         showlegend=False
@@ -1104,19 +2697,91 @@ def create_correlation_matrix(df: pd.DataFrame) -> go.Figure:
     
     return fig
 
-def create_data_quality_report(df: pd.DataFrame) -> pd.DataFrame:
-    # Create a data quality report
-    report = pd.DataFrame({
-        'Kolom': df.columns,
-        'Tipe Data': df.dtypes.values,
-        'Total Nilai Non-Null': df.count().values,
-        'Total Nilai Null': df.isnull().sum().values,
-        '% Nilai Null': (df.isnull().sum() / len(df) * 100).round(2).values,
-        'Total Nilai Unik': df.nunique().values,
-        'Nilai Paling Sering': [df[col].mode()[0] if not df[col].mode().empty and len(df[col].dropna()) > 0 else '-' for col in df.columns]
-    })
-    
-    return report
+def _moments(values: np.ndarray) -> dict:
+    # Statistik setara describe + skew + kurtosis pandas (koreksi bias sampel)
+    n = len(values)
+    mean = values.mean()
+    centered = values - mean
+    m2 = np.dot(centered, centered) / n
+    m3 = np.dot(centered ** 2, centered) / n
+    m4 = np.dot(centered ** 2, centered ** 2) / n
+    std = np.sqrt(m2 * n / (n - 1)) if n > 1 else np.nan
+    skew = np.nan
+    kurtosis = np.nan
+    if n > 2:
+        skew = 0.0 if m2 == 0 else np.sqrt(n * (n - 1)) / (n - 2) * m3 / m2 ** 1.5
+    if n > 3:
+        kurtosis = 0.0 if m2 == 0 else (
+            (n - 1) / ((n - 2) * (n - 3)) * ((n + 1) * (m4 / m2 ** 2 - 3) + 6)
+        )
+    return {"mean": mean, "std": std, "skew": skew, "kurtosis": kurtosis}
+
+
+def _profile_column(series: pd.Series) -> Tuple[dict, Optional[dict]]:
+    # Null, unik, nilai tersering (dan statistik untuk kolom numerik) satu kolom
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        labels = series.cat.categories
+    elif isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufM":
+        values = series.to_numpy()
+        if values.dtype.kind == "M":
+            valid = ~np.isnat(values)
+        elif values.dtype.kind == "f":
+            valid = ~np.isnan(values)
+        else:
+            valid = np.ones(len(values), dtype=bool)
+        codes = None
+    else:
+        codes, labels = pd.factorize(series, use_na_sentinel=True)
+
+    if codes is not None:
+        # Kolom berkode (kategori/teks) cukup satu bincount
+        present = codes[codes >= 0]
+        counts = np.bincount(present, minlength=len(labels))
+        distinct = int(np.count_nonzero(counts))
+        top = labels[int(np.argmax(counts))] if distinct else "-"
+        return {"non_null": len(present), "distinct": distinct, "top": top}, None
+
+    present = values[valid]
+    non_null = len(present)
+    uniques, counts = np.unique(present, return_counts=True)
+    distinct = len(uniques)
+    top = uniques[int(np.argmax(counts))] if len(uniques) else "-"
+    if values.dtype.kind == "M":
+        top = pd.Timestamp(top) if len(uniques) else "-"
+        return {"non_null": non_null, "distinct": distinct, "top": top}, None
+
+    numeric = present.astype("float64")
+    quantiles = np.percentile(numeric, [0, 25, 50, 75, 100]) if non_null else [np.nan] * 5
+    statistics = {"count": float(non_null), **(_moments(numeric) if non_null else {})}
+    statistics.update({"min": quantiles[0], "25%": quantiles[1], "50%": quantiles[2], "75%": quantiles[3], "max": quantiles[4]})
+    return {"non_null": non_null, "distinct": distinct, "top": top}, statistics
+
+
+def profile_frame(df: pd.DataFrame) -> dict:
+    # Laporan kualitas data dan ringkasan statistik dari satu lintasan per kolom
+    rows = []
+    statistics = {}
+    for column in df.columns:
+        profile, column_statistics = _profile_column(df[column])
+        null_count = len(df) - profile["non_null"]
+        rows.append({
+            'Kolom': column,
+            'Tipe Data': str(df[column].dtype),
+            'Total Nilai Non-Null': profile["non_null"],
+            'Total Nilai Null': null_count,
+            '% Nilai Null': round(null_count / len(df) * 100, 2) if len(df) else 0.0,
+            'Total Nilai Unik': profile["distinct"],
+            # Teks agar kolom campuran (tanggal/angka/label) tetap satu tipe Arrow
+            'Nilai Paling Sering': str(profile["top"])
+        })
+        if column_statistics is not None:
+            statistics[column] = column_statistics
+
+    summary = pd.DataFrame.from_dict(statistics, orient="index")
+    if not summary.empty:
+        summary = summary[["count", "mean", "std", "min", "25%", "50%", "75%", "max", "skew", "kurtosis"]]
+    return {"quality": pd.DataFrame(rows), "statistics": summary}
 
 def create_feature_importance_chart(df: pd.DataFrame) -> go.Figure:
     # Simple feature importance based on correlation with target variable
@@ -1185,24 +2850,107 @@ def create_feature_importance_chart(df: pd.DataFrame) -> go.Figure:
     
     return fig
 
-def create_time_series_decomposition(df: pd.DataFrame) -> go.Figure:
-    # Simple time series decomposition
-    if "Tanggal Stock Opname" not in df.columns or "Selisih Value (Rp)" not in df.columns:
-        fig = go.Figure()
-        fig.add_annotation(
-            text="Kolom tanggal atau nilai tidak ditemukan.",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5,
-            showarrow=False,
-            font=dict(color="#CBD5F5", size=16)
-        )
-        fig.update_layout(title="<b>Dekomposisi Time Series</b>", title_x=0.5)
-        return fig
-    
-    # Group by date
-    ts_data = df.groupby(df["Tanggal Stock Opname"].dt.date)["Selisih Value (Rp)"].sum().reset_index()
-    
-    if len(ts_data) < 14:  # Need at least 2 weeks for meaningful decomposition
+@dataclass(frozen=True)
+class DecompositionFit:
+    series: pd.Series
+    trend: pd.Series
+    seasonal: pd.Series
+    resid: pd.Series
+    period: int
+    mode: str  # "penuh" atau "inkremental"
+
+
+def daily_value_series(cube: pd.DataFrame) -> pd.Series:
+    # Varians nilai harian; hari tanpa SO diisi 0 agar jadwal SO tercermin sebagai pola musiman
+    daily = cube.groupby("Tanggal Stock Opname")["Selisih Value (Rp)"].sum().astype("float64")
+    if daily.empty:
+        return daily
+    return daily.asfreq("D", fill_value=0.0)
+
+
+def detect_so_period(series: pd.Series) -> int:
+    # Pilih periode kandidat (mingguan, dua mingguan, bulanan) dengan autokorelasi tertinggi
+    candidates = [period for period in DECOMPOSITION_PERIODS if len(series) >= 2 * period + 1]
+    if not candidates:
+        return DECOMPOSITION_PERIODS[0]
+    values = series.to_numpy() - series.mean()
+    denominator = float(np.dot(values, values))
+    if denominator == 0:
+        return candidates[0]
+    scores = {period: float(np.dot(values[:-period], values[period:])) / denominator for period in candidates}
+    return max(candidates, key=lambda period: scores[period])
+
+
+def _fit_stl(series: pd.Series, period: int) -> Tuple[pd.Series, pd.Series, pd.Series]:
+    result = STL(series, period=period, robust=True).fit()
+    return result.trend, result.seasonal, result.resid
+
+
+def fit_decomposition(series: pd.Series, previous: Optional[DecompositionFit] = None) -> DecompositionFit:
+    # STL atas deret harian; jika deret hanya bertambah hari baru, hanya ekornya yang di-fit ulang
+    extends_previous = (
+        previous is not None
+        and len(series) > len(previous.series)
+        and series.index[0] == previous.series.index[0]
+        and np.array_equal(series.to_numpy()[:len(previous.series)], previous.series.to_numpy())
+    )
+    if extends_previous:
+        period = previous.period
+        window_start = max(0, len(previous.series) - DECOMPOSITION_REFIT_PERIODS * period)
+        if len(series) - window_start >= 2 * period + 1 and window_start > 0:
+            trend, seasonal, resid = _fit_stl(series.iloc[window_start:], period)
+            splice = series.index[len(previous.series) - period]
+
+            def merge(old: pd.Series, new: pd.Series) -> pd.Series:
+                return pd.concat([old[old.index < splice], new[new.index >= splice]])
+
+            return DecompositionFit(
+                series=series,
+                trend=merge(previous.trend, trend),
+                seasonal=merge(previous.seasonal, seasonal),
+                resid=merge(previous.resid, resid),
+                period=period,
+                mode="inkremental"
+            )
+
+    period = detect_so_period(series)
+    trend, seasonal, resid = _fit_stl(series, period)
+    return DecompositionFit(series=series, trend=trend, seasonal=seasonal, resid=resid, period=period, mode="penuh")
+
+
+@st.cache_resource(show_spinner=False)
+def get_decomposition_store() -> dict:
+    # (versi dataset, tanggal akhir data, fit) terakhir per garis filter (tanggal awal, tag, arah, toko)
+    return {"lock": threading.Lock(), "fits": OrderedDict()}
+
+
+def decompose_view(view: FilterView, dataset: Dataset) -> Optional[DecompositionFit]:
+    # Dekomposisi view; fit inkremental hanya untuk hari SO baru setelah versi dataset berganti
+    series = daily_value_series(view.cube)
+    if len(series) < 14:  # Need at least 2 weeks for meaningful decomposition
+        return None
+    start_ts, _, *selections = view.spec
+    lineage = (start_ts, *selections)
+    data_end = dataset.frame["Tanggal Stock Opname"].iloc[-1]
+    store = get_decomposition_store()
+    with store["lock"]:
+        record = store["fits"].get(lineage)
+    previous = None
+    if record is not None:
+        version, previous_data_end, previous_fit = record
+        if version != dataset.version and previous_fit.series.index[-1] == previous_data_end:
+            previous = previous_fit
+    fit = fit_decomposition(series, previous)
+    with store["lock"]:
+        store["fits"][lineage] = (dataset.version, data_end, fit)
+        store["fits"].move_to_end(lineage)
+        while len(store["fits"]) > FILTER_CACHE_SIZE:
+            store["fits"].popitem(last=False)
+    return fit
+
+
+def create_time_series_decomposition(fit: Optional[DecompositionFit]) -> go.Figure:
+    if fit is None:
         fig = go.Figure()
         fig.add_annotation(
             text="Data tidak cukup untuk dekomposisi time series (minimal 14 hari).",
@@ -1217,51 +2965,23 @@ def create_time_series_decomposition(df: pd.DataFrame) -> go.Figure:
     # Create figure with subplots
     fig = make_subplots(
         rows=4, cols=1,
-        subplot_titles=("Data Asli", "Tren", "Musiman", "Residual"),
+        subplot_titles=("Data Asli", "Tren", f"Musiman (periode {fit.period} hari)", "Residual"),
         vertical_spacing=0.05
     )
     
-    # Original data
-    fig.add_trace(
-        go.Scatter(x=ts_data["Tanggal Stock Opname"], y=ts_data["Selisih Value (Rp)"],
-                  mode='lines', name='Data Asli', line=dict(color=COLOR_PRIMARY)),
-        row=1, col=1
-    )
-    
-    # Trend (simple moving average)
-    window = min(7, len(ts_data) // 3)
-    ts_data["Trend"] = ts_data["Selisih Value (Rp)"].rolling(window=window, center=True).mean()
-    fig.add_trace(
-        go.Scatter(x=ts_data["Tanggal Stock Opname"], y=ts_data["Trend"],
-                  mode='lines', name='Tren', line=dict(color=COLOR_ACCENT)),
-        row=2, col=1
-    )
-    
-    # Seasonality (simplified - day of week pattern)
-    if len(ts_data) >= 14:
-        ts_data["DayOfWeek"] = pd.to_datetime(ts_data["Tanggal Stock Opname"]).dt.dayofweek
-        seasonal_pattern = ts_data.groupby("DayOfWeek")["Selisih Value (Rp)"].mean()
-        ts_data["Seasonal"] = ts_data["DayOfWeek"].map(seasonal_pattern)
+    for row, (name, values, color) in enumerate([
+        ("Data Asli", fit.series, COLOR_PRIMARY),
+        ("Tren", fit.trend, COLOR_ACCENT),
+        ("Musiman", fit.seasonal, COLOR_SUCCESS),
+        ("Residual", fit.resid, COLOR_WARNING),
+    ], start=1):
         fig.add_trace(
-            go.Scatter(x=ts_data["Tanggal Stock Opname"], y=ts_data["Seasonal"],
-                      mode='lines', name='Musiman', line=dict(color=COLOR_SUCCESS)),
-            row=3, col=1
+            go.Scatter(x=values.index, y=values.to_numpy(), mode='lines', name=name, line=dict(color=color)),
+            row=row, col=1
         )
     
-    # Residual
-    if "Seasonal" in ts_data.columns:
-        ts_data["Residual"] = ts_data["Selisih Value (Rp)"] - ts_data["Trend"] - ts_data["Seasonal"]
-    else:
-        ts_data["Residual"] = ts_data["Selisih Value (Rp)"] - ts_data["Trend"]
-    
-    fig.add_trace(
-        go.Scatter(x=ts_data["Tanggal Stock Opname"], y=ts_data["Residual"],
-                  mode='lines', name='Residual', line=dict(color=COLOR_WARNING)),
-        row=4, col=1
-    )
-    
     fig.update_layout(
-        title="<b>Dekomposisi Time Series Varians Nilai</b>",
+        title=f"<b>Dekomposisi Time Series Varians Nilai</b> <sup>(STL, fit {fit.mode})</sup>",
         title_x=0.5,
         height=800,
         showlegend=False
@@ -1292,28 +3012,27 @@ with st.sidebar:
     sheet_name = st.text_input(
         "Nama Worksheet",
         value="RekapSO",
-        help="Pastikan nama worksheet sesuai dengan di Google Sheets."
+        help=(
+            "Pastikan nama worksheet sesuai dengan di Google Sheets. Untuk sheet per periode, "
+            "isi daftar dipisah koma atau pola seperti `RekapSO_2025_*`; semua sheet yang cocok digabung."
+        )
     )
 
-    st.markdown("---")
-
-    metric_selection = st.radio(
-        "Pilih Metrik Utama",
-        options=["Nilai (Rp)", "Kuantitas (Pcs)"],
-        horizontal=True
-    )
-    top_n = st.slider(
-        "Tampilkan Top Produk",
-        min_value=5,
-        max_value=30,
-        value=10,
-        step=1
-    )
+    # Mode multi-toko: mapping dari secrets [stores], atau diisi manual per baris
+    try:
+        store_urls = {str(name): str(url) for name, url in st.secrets["stores"].items()}
+        st.caption(f"🏬 Mode multi-toko: {len(store_urls)} toko dari Secrets.")
+    except (KeyError, FileNotFoundError):
+        store_urls = parse_store_mapping(st.text_area(
+            "Daftar Toko (opsional)",
+            placeholder="2GC6 BAROS PANDEGLANG = https://docs.google.com/spreadsheets/d/...",
+            help="Satu toko per baris dengan format `Nama Toko = URL`. Jika diisi, semua toko dimuat paralel dan digabung."
+        ))
 
     st.markdown("---")
 
     if st.button("🔄 Reset Semua Filter", use_container_width=True):
-        for key in ("date_range", "tags", "direction"):
+        for key in ("date_range", "tags", "direction", "stores"):
             if key in st.session_state:
                 del st.session_state[key]
         st.rerun()
@@ -1321,40 +3040,119 @@ with st.sidebar:
 # =========================================================
 # ---------------------- MAIN APP -------------------------
 # =========================================================
+if store_urls:
+    store_label = ", ".join(store_urls) if len(store_urls) <= 3 else f"{len(store_urls)} toko"
+else:
+    store_label = DEFAULT_STORE_NAME
+
 st.markdown(
-    """
+    f"""
     <div class="hero-card">
         <h1>📈 Dashboard Analisis Varians Stok Opname</h1>
         <p>Menghadirkan visual interaktif dan insight instan untuk memantau dinamika varians stok secara komprehensif.
-        <br/><strong>📍 Toko:</strong> 2GC6 BAROS PANDEGLANG</p>
+        <br/><strong>📍 Toko:</strong> {store_label}</p>
     </div>
     """,
     unsafe_allow_html=True
 )
 
-if not spreadsheet_url.strip():
+if not store_urls and not spreadsheet_url.strip():
     st.warning("Masukkan URL Google Spreadsheet terlebih dahulu untuk memulai.")
     st.stop()
 
 with st.spinner("Memuat dan memproses data dari Google Sheets..."):
-    dataframe = load_data(spreadsheet_url, sheet_name)
+    if store_urls:
+        dataset, dataset_status = get_combined_dataset(store_urls, sheet_name)
+    elif is_pattern_spec(sheet_name):
+        dataset, dataset_status = get_combined_dataset({None: spreadsheet_url}, sheet_name)
+    else:
+        dataset, dataset_status = get_dataset(spreadsheet_url, sheet_name)
 
-if dataframe is None or dataframe.empty:
-    st.error("Tidak ada data yang dapat diproses. Periksa kembali sumber data Anda.")
+if dataset is None:
+    st.error(f"Gagal memuat data: {dataset_status['error']}")
     st.stop()
 
-# PERBAIKAN: Tangani tanggal yang tidak valid
-dataframe = dataframe[~dataframe["Tanggal Stock Opname"].isna()]
+dataframe = dataset.frame
+
+freshness_label = f"🕒 Data per {(dataset_status.get('fetched_at') or dataset.fetched_at):%H:%M}"
+if dataset_status["refreshing"]:
+    freshness_label += " • memperbarui di latar belakang…"
+elif dataset_status["error"]:
+    freshness_label += " • pembaruan terakhir gagal"
+st.markdown(f'<div class="freshness-badge">{freshness_label}</div>', unsafe_allow_html=True)
+
+pending_sources = [source_label(row) for row in dataset_status.get("sources", []) if row["Status"] == "masih dimuat"]
+if pending_sources:
+    st.info(f"Masih dimuat dan belum ikut ditampilkan: {', '.join(pending_sources)}. Muat ulang halaman sebentar lagi.")
+if dataset_status.get("sources") and dataset_status["error"]:
+    st.warning(f"Sebagian sumber gagal dimuat: {dataset_status['error']}")
 
 if dataframe.empty:
-    st.error("Data tanggal tidak valid. Periksa format tanggal pada data sumber.")
+    if dataframe.attrs.get("date_parse_report", {}).get("NaT"):
+        st.error("Data tanggal tidak valid. Periksa format tanggal pada data sumber.")
+    else:
+        st.error("Tidak ada data yang dapat diproses. Periksa kembali sumber data Anda.")
     st.stop()
 
+with st.sidebar:
+    with st.expander("🩺 Diagnostik Data", expanded=False):
+        if dataset_status.get("sources"):
+            st.caption("Status pemuatan per sumber (sheet arsip tidak diunduh ulang):")
+            st.dataframe(pd.DataFrame(dataset_status["sources"]), use_container_width=True, hide_index=True)
+        if dataset.source == "snapshot":
+            st.caption(
+                f"Menyajikan snapshot lokal ({dataframe.attrs.get('snapshot_read_ms', 0):.0f} ms baca disk), "
+                "sinkronisasi dengan sheet berjalan di latar belakang."
+            )
+        if dataframe.attrs.get("snapshot_error"):
+            st.caption(f"Snapshot tidak tersimpan: {dataframe.attrs['snapshot_error']}")
+        sync_report = dataframe.attrs.get("sync_report")
+        if sync_report:
+            st.caption(
+                f"Sinkronisasi {sync_report['mode']}: {format_quantity(sync_report['baris_diambil'])} baris diambil, "
+                f"total {format_quantity(sync_report['total_baris'])} baris di sheet."
+            )
+        timing_report = get_sheets_client_pool().timing_report()
+        if not timing_report.empty:
+            st.caption("Latensi Google Sheets (auth vs open vs fetch):")
+            st.dataframe(timing_report, use_container_width=True, hide_index=True)
+        memory_report = dataframe.attrs.get("memory_report")
+        if memory_report:
+            st.caption(
+                f"Memori dataset: {memory_report['sebelum'] / 1024 ** 2:.1f} MB → "
+                f"{memory_report['sesudah'] / 1024 ** 2:.1f} MB setelah skema ringkas."
+            )
+        date_report = dataframe.attrs.get("date_parse_report", {})
+        if date_report:
+            st.caption("Parsing tanggal (baris per format):")
+            st.dataframe(
+                pd.Series(date_report, name="Baris").rename_axis("Format").to_frame(),
+                use_container_width=True
+            )
+        filter_stats = get_filter_cache().usage()
+        st.caption(
+            f"Cache filter bersama: {filter_stats['hit']} hit / {filter_stats['miss']} miss, "
+            f"{filter_stats['entri']}/{FILTER_CACHE_SIZE} entri."
+        )
+        session_report = track_session(dataset)
+        rss = process_rss_bytes()
+        st.caption(
+            f"Dataset bersama v{dataset.version} (read-only, satu salinan per proses) • "
+            f"{session_report['active']} sesi aktif"
+            + (f" • RSS {rss / 1024 ** 2:.0f} MB" if rss else "")
+        )
+        if len(session_report["samples"]) > 1:
+            st.caption("RSS proses saat sesi baru bergabung:")
+            st.dataframe(pd.DataFrame(session_report["samples"]), use_container_width=True, hide_index=True)
+        # Diisi setelah view terfilter tersedia (lihat di bawah filter sidebar)
+        hash_cost_slot = st.container()
+
 min_date = dataframe["Tanggal Stock Opname"].min().to_pydatetime()
 max_date = dataframe["Tanggal Stock Opname"].max().to_pydatetime()
 available_tags = sorted(dataframe["Tag"].unique().tolist())
 available_tags_display = ["Semua"] + available_tags
 directions = ["Semua", "Positif", "Negatif", "Netral"]
+available_stores = dataframe["Toko"].cat.categories.tolist() if "Toko" in dataframe.columns else []
 
 with st.sidebar:
     st.subheader("🧮 Filter")
@@ -1377,13 +3175,26 @@ with st.sidebar:
         default=["Semua"],
         key="direction"
     )
+    selected_stores = None
+    if len(available_stores) > 1:
+        selected_stores = st.multiselect(
+            "Filter Toko",
+            options=["Semua"] + available_stores,
+            default=["Semua"],
+            key="stores"
+        )
 
-filtered_df = filter_dataframe(
-    dataframe,
-    date_range=selected_date_range,
-    selected_tags=selected_tags,
-    selected_direction=selected_direction
-)
+view = get_filter_view(dataset, selected_date_range, selected_tags, selected_direction, selected_stores)
+filtered_df = view.frame
+filtered_cube = view.cube
+
+with hash_cost_slot:
+    if st.button("#️⃣ Ukur biaya hashing", key="measure_hash_cost"):
+        hash_cost = view.derive("hash_cost", lambda: measure_hash_cost(view))
+        st.caption(
+            f"Kunci cache `{view.fingerprint}`: hash isi frame {hash_cost['frame_ms']:.2f} ms "
+            f"vs fingerprint {hash_cost['token_ms']:.4f} ms per panggilan."
+        )
 
 if filtered_df.empty:
     st.warning("Filter saat ini tidak menghasilkan data. Sesuaikan parameter filter atau gunakan tombol 'Reset Semua Filter'.")
@@ -1394,16 +3205,15 @@ if filtered_df.empty:
 # =========================================================
 st.subheader("🔑 Ringkasan Eksekutif")
 
-total_qty = filtered_df["Selisih Qty (Pcs)"].sum()
-total_value = filtered_df["Selisih Value (Rp)"].sum()
-total_plu = filtered_df["PLU"].nunique()
-positive_value = filtered_df.loc[filtered_df["Selisih Value (Rp)"] > 0, "Selisih Value (Rp)"].sum()
-negative_value = filtered_df.loc[filtered_df["Selisih Value (Rp)"] < 0, "Selisih Value (Rp)"].sum()
-positive_qty = filtered_df.loc[filtered_df["Selisih Qty (Pcs)"] > 0, "Selisih Qty (Pcs)"].sum()
-negative_qty = filtered_df.loc[filtered_df["Selisih Qty (Pcs)"] < 0, "Selisih Qty (Pcs)"].sum()
-
-# PERBAIKAN: Hindari pembagian nol
-avg_value_per_plu = total_value / total_plu if total_plu > 0 else 0
+kpis = view.derive("kpis", lambda: compute_kpis(filtered_df))
+total_qty = kpis.total_qty
+total_value = kpis.total_value
+total_plu = kpis.total_plu
+positive_value = kpis.positive_value
+negative_value = kpis.negative_value
+positive_qty = kpis.positive_qty
+negative_qty = kpis.negative_qty
+avg_value_per_plu = kpis.avg_value_per_plu
 
 metric_container = st.container()
 with metric_container:
@@ -1434,12 +3244,79 @@ with metric_container:
     )
     st.markdown('</div>', unsafe_allow_html=True)
 
-highlight_insights(filtered_df)
+highlight_insights(view)
 st.divider()
 
 # =========================================================
 # -------------------- VISUALISASI ------------------------
 # =========================================================
+# Widget yang dibaca tiap fragmen. Filter sidebar selalu memicu rerun penuh (widget sidebar
+# tidak bisa dimiliki fragmen), sedangkan widget di bawah ini hanya merender ulang fragmennya.
+FRAGMENT_DEPENDENCIES = {
+    "Analisis Produk": ("filter", "metric_selection", "top_n"),
+    "Tren Waktu": ("filter", "metric_selection"),
+    "Analisis Tag": ("filter", "metric_selection"),
+    "Analisis Kategori": ("filter", "metric_selection"),
+}
+METRIC_OPTIONS = ["Nilai (Rp)", "Kuantitas (Pcs)"]
+
+
+@contextmanager
+def fragment_cost(name: str):
+    start = time.perf_counter()
+    yield
+    elapsed = (time.perf_counter() - start) * 1000
+    st.caption(
+        f"⏱️ Rerun fragmen {name}: {elapsed:.0f} ms • bergantung pada {', '.join(FRAGMENT_DEPENDENCIES[name])}"
+    )
+
+
+def metric_control() -> str:
+    # Satu key untuk semua tab metrik; persist_state menjaga pilihan saat tab lain aktif
+    return st.radio(
+        "Pilih Metrik Utama",
+        options=METRIC_OPTIONS,
+        horizontal=True,
+        key="metric_selection",
+        persist_state="page"
+    )
+
+
+@st.fragment
+def render_top_products_fragment(view: FilterView) -> None:
+    with fragment_cost("Analisis Produk"):
+        col1, col2 = st.columns(2)
+        with col1:
+            metric_selection = metric_control()
+        with col2:
+            top_n = st.slider(
+                "Tampilkan Top Produk",
+                min_value=5,
+                max_value=30,
+                value=10,
+                step=1,
+                key="top_n",
+                persist_state="page"
+            )
+        st.plotly_chart(
+            view.derive(
+                f"top_products:{metric_selection}:{top_n}",
+                lambda: create_top_products_chart(view.cube, metric_selection, top_n)
+            ),
+            use_container_width=True
+        )
+
+
+@st.fragment
+def render_metric_chart_fragment(view: FilterView, name: str, chart_key: str, build_chart) -> None:
+    with fragment_cost(name):
+        metric_selection = metric_control()
+        st.plotly_chart(
+            view.derive(f"{chart_key}:{metric_selection}", lambda: build_chart(view.cube, metric_selection)),
+            use_container_width=True
+        )
+
+
 tabs = st.tabs([
     "🔍 Analisis Data Mendalam",
     "🏆 Analisis Produk",
@@ -1448,181 +3325,264 @@ tabs = st.tabs([
     "📊 Analisis Kategori",
     "🔍 Scatter Varians",
     "🗺️ Treemap"
-])
+], key="analysis_tab", on_change="rerun")
+
+# Dengan on_change="rerun" hanya tab aktif yang ditandai open; tab lain dilewati sepenuhnya
+# dan figurnya dihitung saat pertama dibuka lalu disimpan di memo FilterView.
 
 with tabs[0]:
-    st.subheader("🔍 Analisis Data Mendalam")
-    
-    # Data Quality Report
-    with st.expander("📋 Laporan Kualitas Data", expanded=True):
-        quality_report = create_data_quality_report(filtered_df)
-        st.dataframe(quality_report, use_container_width=True)
-    
-    # Distribution Charts
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-        st.plotly_chart(create_distribution_chart(filtered_df, "Selisih Value (Rp)"), use_container_width=True)
-        st.markdown('</div>', unsafe_allow_html=True)
+    if tabs[0].open:
+        st.subheader("🔍 Analisis Data Mendalam")
+    
+        # Data Quality Report
+        profile = view.derive("profile", lambda: profile_frame(filtered_df))
+        with st.expander("📋 Laporan Kualitas Data", expanded=True):
+            st.dataframe(profile["quality"], use_container_width=True)
+    
+        # Distribution Charts
+        histogram_scale = "symlog" if st.toggle(
+            "Skala symlog untuk histogram",
+            key="histogram_symlog",
+            help="Bin rata pada skala log bertanda, cocok untuk ekor panjang nilai Rupiah."
+        ) else "linear"
+        col1, col2 = st.columns(2)
+    
+        with col1:
+            st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+            st.plotly_chart(
+                view.derive(
+                    f"distribution:value:{histogram_scale}",
+                    lambda: create_distribution_chart(filtered_df, "Selisih Value (Rp)", histogram_scale)
+                ),
+                use_container_width=True
+            )
+            st.markdown('</div>', unsafe_allow_html=True)
+    
+        with col2:
+            st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+            st.plotly_chart(
+                view.derive(
+                    f"distribution:qty:{histogram_scale}",
+                    lambda: create_distribution_chart(filtered_df, "Selisih Qty (Pcs)", histogram_scale)
+                ),
+                use_container_width=True
+            )
+            st.markdown('</div>', unsafe_allow_html=True)
+    
+        # Box Plots
+        col1, col2 = st.columns(2)
+    
+        with col1:
+            st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+            st.plotly_chart(
+                view.derive(
+                    "box:value",
+                    lambda: create_box_plot(iqr_stats(view.fingerprint, filtered_df, "Selisih Value (Rp)"), "Selisih Value (Rp)")
+                ),
+                use_container_width=True
+            )
+            st.markdown('</div>', unsafe_allow_html=True)
+    
+        with col2:
+            st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+            st.plotly_chart(
+                view.derive(
+                    "box:qty",
+                    lambda: create_box_plot(iqr_stats(view.fingerprint, filtered_df, "Selisih Qty (Pcs)"), "Selisih Qty (Pcs)")
+                ),
+                use_container_width=True
+            )
+            st.markdown('</div>', unsafe_allow_html=True)
     
-    with col2:
-        st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-        st.plotly_chart(create_distribution_chart(filtered_df, "Selisih Qty (Pcs)"), use_container_width=True)
+        # Correlation Matrix
+        st.markdown('<div class="correlation-matrix">', unsafe_allow_html=True)
+        st.plotly_chart(view.derive("correlation", lambda: create_correlation_matrix(filtered_df)), use_container_width=True)
         st.markdown('</div>', unsafe_allow_html=True)
     
-    # Box Plots
-    col1, col2 = st.columns(2)
-    
-    with col1:
+        # Feature Importance
         st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-        st.plotly_chart(create_box_plot(filtered_df, "Selisih Value (Rp)"), use_container_width=True)
+        st.plotly_chart(view.derive("feature_importance", lambda: create_feature_importance_chart(filtered_df)), use_container_width=True)
         st.markdown('</div>', unsafe_allow_html=True)
     
-    with col2:
+        # Time Series Decomposition
         st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-        st.plotly_chart(create_box_plot(filtered_df, "Selisih Qty (Pcs)"), use_container_width=True)
+        st.plotly_chart(view.derive("decomposition", lambda: create_time_series_decomposition(decompose_view(view, dataset))), use_container_width=True)
         st.markdown('</div>', unsafe_allow_html=True)
     
-    # Correlation Matrix
-    st.markdown('<div class="correlation-matrix">', unsafe_allow_html=True)
-    st.plotly_chart(create_correlation_matrix(filtered_df), use_container_width=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    # Feature Importance
-    st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-    st.plotly_chart(create_feature_importance_chart(filtered_df), use_container_width=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    # Time Series Decomposition
-    st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-    st.plotly_chart(create_time_series_decomposition(filtered_df), use_container_width=True)
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    # Statistical Summary
-    with st.expander("📊 Ringkasan Statistik", expanded=False):
-        numeric_cols = filtered_df.select_dtypes(include=[np.number]).columns
-        if len(numeric_cols) > 0:
-            stats_summary = filtered_df[numeric_cols].describe().T
-            stats_summary['skew'] = filtered_df[numeric_cols].skew()
-            stats_summary['kurtosis'] = filtered_df[numeric_cols].kurtosis()
-            st.dataframe(stats_summary, use_container_width=True)
-        else:
-            st.info("Tidak ada kolom numerik untuk analisis statistik.")
+        # Statistical Summary
+        with st.expander("📊 Ringkasan Statistik", expanded=False):
+            if not profile["statistics"].empty:
+                st.dataframe(profile["statistics"], use_container_width=True)
+            else:
+                st.info("Tidak ada kolom numerik untuk analisis statistik.")
 
 with tabs[1]:
-    st.plotly_chart(create_top_products_chart(filtered_df, metric_selection, top_n), use_container_width=True)
+    if tabs[1].open:
+        render_top_products_fragment(view)
 
 with tabs[2]:
-    st.plotly_chart(create_trend_chart(filtered_df, metric_selection), use_container_width=True)
+    if tabs[2].open:
+        render_metric_chart_fragment(view, "Tren Waktu", "trend", create_trend_chart)
 
 with tabs[3]:
-    st.plotly_chart(create_tag_analysis_chart(filtered_df, metric_selection), use_container_width=True)
+    if tabs[3].open:
+        render_metric_chart_fragment(view, "Analisis Tag", "tag", create_tag_analysis_chart)
 
 with tabs[4]:
-    st.plotly_chart(create_category_analysis_chart(filtered_df, metric_selection), use_container_width=True)
+    if tabs[4].open:
+        render_metric_chart_fragment(view, "Analisis Kategori", "category", create_category_analysis_chart)
 
 with tabs[5]:
-    st.plotly_chart(create_scatter_chart(filtered_df), use_container_width=True)
+    if tabs[5].open:
+        st.plotly_chart(view.derive("scatter", lambda: create_scatter_chart(filtered_df)), use_container_width=True)
 
 with tabs[6]:
-    # PERBAIKAN: Tambahkan penanganan error untuk treemap
-    try:
-        st.plotly_chart(create_treemap_chart(filtered_df), use_container_width=True)
-    except Exception as e:
-        st.error(f"Error saat membuat treemap: {str(e)}")
-        st.info("Mencoba metode alternatif...")
+    if tabs[6].open:
+        # PERBAIKAN: Tambahkan penanganan error untuk treemap
+        try:
+            st.plotly_chart(view.derive("treemap", lambda: create_treemap_chart(filtered_cube)), use_container_width=True)
+        except Exception as e:
+            st.error(f"Error saat membuat treemap: {str(e)}")
+            st.info("Mencoba metode alternatif...")
         
-        # Alternatif: tampilkan chart sederhana sebagai pengganti
-        fig = go.Figure()
-        fig.add_annotation(
-            text="Treemap tidak dapat ditampilkan. Data mungkin memiliki masalah format.",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5,
-            showarrow=False,
-            font=dict(color="#CBD5F5", size=16)
-        )
-        fig.update_layout(title="<b>Treemap Varians</b>", title_x=0.5)
-        st.plotly_chart(fig, use_container_width=True)
+            # Alternatif: tampilkan chart sederhana sebagai pengganti
+            fig = go.Figure()
+            fig.add_annotation(
+                text="Treemap tidak dapat ditampilkan. Data mungkin memiliki masalah format.",
+                xref="paper", yref="paper",
+                x=0.5, y=0.5,
+                showarrow=False,
+                font=dict(color="#CBD5F5", size=16)
+            )
+            fig.update_layout(title="<b>Treemap Varians</b>", title_x=0.5)
+            st.plotly_chart(fig, use_container_width=True)
 
 st.divider()
 
 # =========================================================
 # ------------------- TABEL DETAIL ------------------------
 # =========================================================
-def clean_dataframe_for_display(df: pd.DataFrame) -> pd.DataFrame:
-    """Membersihkan dataframe untuk ditampilkan di Streamlit"""
-    df_clean = df.copy()
-    
-    # Reset index
-    df_clean = df_clean.reset_index(drop=True)
-    
-    # Konversi kolom tanggal ke string
-    if "Tanggal Stock Opname" in df_clean.columns:
-        df_clean["Tanggal Stock Opname"] = df_clean["Tanggal Stock Opname"].dt.strftime("%Y-%m-%d")
-    
-    # Daftar kolom numerik
-    numeric_columns = df_clean.select_dtypes(include=[np.number]).columns
-    # Daftar kolom non-numerik
-    non_numeric_columns = df_clean.select_dtypes(exclude=[np.number]).columns
-    
-    # Untuk kolom non-numerik, ganti NaN dengan string kosong
-    df_clean[non_numeric_columns] = df_clean[non_numeric_columns].fillna('')
-    
-    # Untuk kolom numerik, ganti NaN dengan 0
-    df_clean[numeric_columns] = df_clean[numeric_columns].fillna(0)
-    
-    # Format kolom numerik khusus
-    if "Selisih Qty (Pcs)" in df_clean.columns:
-        df_clean["Selisih Qty (Pcs)"] = df_clean["Selisih Qty (Pcs)"].apply(
-            lambda x: format_quantity(x) if isinstance(x, (int, float)) else str(x)
-        )
-    
-    if "Selisih Value (Rp)" in df_clean.columns:
-        df_clean["Selisih Value (Rp)"] = df_clean["Selisih Value (Rp)"].apply(
-            lambda x: format_currency(x) if isinstance(x, (int, float)) else str(x)
-        )
-    
-    if "Varians Nilai Absolut" in df_clean.columns:
-        df_clean["Varians Nilai Absolut"] = df_clean["Varians Nilai Absolut"].apply(
-            lambda x: format_currency(x) if isinstance(x, (int, float)) else str(x)
+DETAIL_PAGE_SIZES = [25, 50, 100, 250]
+DETAIL_SEARCH_COLUMNS = ["PLU", "Nama Produk"]
+DETAIL_COLUMN_CONFIG = {
+    "Tanggal Stock Opname": st.column_config.DateColumn("Tanggal Stock Opname", format="YYYY-MM-DD"),
+    "Selisih Qty (Pcs)": st.column_config.NumberColumn("Selisih Qty (Pcs)", format="localized"),
+    "Selisih Value (Rp)": st.column_config.NumberColumn("Selisih Value (Rp)", format="localized"),
+    "Varians Nilai Absolut": st.column_config.NumberColumn("Varians Nilai Absolut", format="localized"),
+    "Varians Qty Absolut": st.column_config.NumberColumn("Varians Qty Absolut", format="localized"),
+}
+
+
+def detail_row_order(df: pd.DataFrame, search: str, sort_column: str, ascending: bool) -> np.ndarray:
+    # Posisi baris (iloc) hasil pencarian PLU/Nama Produk lalu diurutkan; tanpa menyalin frame
+    positions = np.arange(len(df))
+    needle = search.strip().lower()
+    if needle:
+        matches = np.zeros(len(df), dtype=bool)
+        for column in DETAIL_SEARCH_COLUMNS:
+            if column not in df.columns:
+                continue
+            series = df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Cocokkan daftar kategori sekali, lalu petakan lewat kode
+                hits = np.flatnonzero(series.cat.categories.astype(str).str.lower().str.contains(needle, regex=False))
+                matches |= np.isin(series.cat.codes.to_numpy(), hits)
+            else:
+                matches |= series.astype(str).str.lower().str.contains(needle, regex=False).fillna(False).to_numpy()
+        positions = positions[matches]
+    if sort_column in df.columns:
+        column = df[sort_column]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Kategori hasil union_categoricals berurutan kemunculan; urutkan berdasarkan nilainya
+            column = column.cat.reorder_categories(column.cat.categories.sort_values())
+        ordered = (
+            column.iloc[positions].reset_index(drop=True)
+            .sort_values(ascending=ascending, kind="stable", na_position="last")
         )
-    
-    if "Varians Qty Absolut" in df_clean.columns:
-        df_clean["Varians Qty Absolut"] = df_clean["Varians Qty Absolut"].apply(
-            lambda x: format_quantity(x) if isinstance(x, (int, float)) else str(x)
+        positions = positions[ordered.index.to_numpy()]
+    return positions
+
+
+FRAGMENT_DEPENDENCIES["Data Detail"] = ("filter", "detail_search", "detail_sort", "detail_page")
+
+
+@st.fragment
+def render_detail_table(view: FilterView) -> None:
+    with fragment_cost("Data Detail"):
+        df = view.frame
+        col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+        with col1:
+            search = st.text_input("Cari PLU / Nama Produk", key="detail_search")
+        with col2:
+            sort_column = st.selectbox("Urutkan", options=list(df.columns), key="detail_sort")
+        with col3:
+            ascending = st.toggle("Naik", value=False, key="detail_ascending")
+        with col4:
+            page_size = st.selectbox("Baris", options=DETAIL_PAGE_SIZES, index=1, key="detail_page_size")
+
+        needle = search.strip().lower()
+        if needle:
+            # Hasil pencarian bebas tidak masuk memo view bersama (tak terbatas); cukup satu per sesi
+            search_key = (view.fingerprint, needle, sort_column, ascending)
+            cached = st.session_state.get("detail_search_order")
+            if cached is None or cached[0] != search_key:
+                cached = (search_key, detail_row_order(df, search, sort_column, ascending))
+                st.session_state["detail_search_order"] = cached
+            positions = cached[1]
+        else:
+            positions = view.derive(
+                f"detail_order:{sort_column}:{ascending}",
+                lambda: detail_row_order(df, "", sort_column, ascending)
+            )
+        page_count = max(1, -(-len(positions) // page_size))
+        page = st.number_input("Halaman", min_value=1, max_value=page_count, value=1, step=1, key="detail_page")
+        page = min(int(page), page_count)
+        start = (page - 1) * page_size
+        page_df = df.iloc[positions[start:start + page_size]]
+        st.caption(
+            f"Menampilkan baris {start + 1 if len(positions) else 0}–{start + len(page_df)} "
+            f"dari {format_quantity(len(positions))} • halaman {page}/{page_count}"
         )
-    
-    return df_clean
 
-with st.expander("📄 Lihat Data Detail", expanded=False):
-    # Gunakan fungsi pembersih dataframe yang baru
-    df_display = clean_dataframe_for_display(filtered_df)
-    
-    # PERBAIKAN: Pastikan tidak ada nilai NaN yang tersisa
-    for col in df_display.columns:
-        df_display[col] = df_display[col].astype(str)
-    
-    # Tampilkan dataframe dengan handling error
-    try:
-        st.dataframe(df_display, use_container_width=True)
-    except Exception as e:
-        st.error(f"Error menampilkan dataframe: {e}")
-        st.info("Menampilkan data dalam format alternatif...")
-        
-        # Alternatif 1: tampilkan dengan st.table
-        st.table(df_display.head(100))  # Batasi untuk performa
-        
-        # Alternatif 2: berikan opsi download
+        # Tipe asli dipertahankan; format angka/tanggal dilakukan di sisi tampilan
         try:
-            csv_data = df_display.to_csv(index=False, encoding='utf-8')
-            st.download_button(
-                label="📥 Download Data sebagai CSV",
-                data=csv_data,
-                file_name="data_varians_stok.csv",
-                mime="text/csv"
+            st.dataframe(
+                page_df,
+                use_container_width=True,
+                hide_index=True,
+                column_config=DETAIL_COLUMN_CONFIG
             )
-        except Exception as e2:
-            st.error(f"Error membuat file CSV: {e2}")
+        except Exception as e:
+            st.error(f"Error menampilkan dataframe: {e}")
+            st.table(page_df.astype(str))
+
+
+detail_expander = st.expander("📄 Lihat Data Detail", expanded=False, key="detail_expander", on_change="rerun")
+with detail_expander:
+    if detail_expander.open:
+        render_detail_table(view)
+
+st.subheader("📦 Ekspor Data Terfilter")
+st.caption(
+    "File dibuat saat tombol diklik dan disimpan per kondisi filter; klik berikutnya langsung diunduh. "
+    f"Excel memuat maksimal {format_quantity(EXCEL_MAX_ROWS)} baris data."
+)
+export_columns = st.columns(3)
+for export_column, (file_format, label, mime) in zip(export_columns, [
+    ("csv", "📥 CSV", "text/csv"),
+    ("parquet", "📥 Parquet", "application/vnd.apache.parquet"),
+    ("xlsx", "📥 Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+]):
+    with export_column:
+        st.download_button(
+            label=label,
+            data=lambda file_format=file_format: export_view(view, file_format),
+            file_name=f"data_varians_stok_{view.fingerprint}.{file_format}",
+            mime=mime,
+            key=f"export_{file_format}",
+            on_click="ignore",
+            use_container_width=True
+        )
 
 st.caption("© 2025 – Dashboard Varians Stok Opname • Dibangun dengan Streamlit + Plotly • Desain futuristic-glassmorphism")
+
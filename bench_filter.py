@@ -0,0 +1,132 @@
+"""Benchmark filter: boolean mask lama vs FilterIndex, di luar proses dashboard.
+
+Penggunaan:
+    python bench_filter.py                       # snapshot terbaru di SO_SNAPSHOT_DIR, atau data sintetis
+    python bench_filter.py --snapshot PATH.parquet
+    python bench_filter.py --rows 200000 > bench_output.txt
+
+Definisi (fungsi, kelas, konstanta) diambil dari app.py tanpa menjalankan UI Streamlit.
+"""
+import argparse
+import ast
+import sys
+import time
+import types
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+APP_PATH = Path(__file__).with_name("app.py")
+
+
+def load_app_definitions(path: Path = APP_PATH) -> types.ModuleType:
+    """Eksekusi hanya import, def/class, dan konstanta huruf besar dari app.py."""
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    body = [
+        node for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef))
+        or (
+            isinstance(node, ast.Assign)
+            and all(isinstance(target, ast.Name) and target.id.isupper() for target in node.targets)
+        )
+    ]
+    module = types.ModuleType("rekapso_app")
+    module.__file__ = str(path)
+    sys.modules[module.__name__] = module
+    exec(compile(ast.Module(body=body, type_ignores=[]), str(path), "exec"), module.__dict__)
+    return module
+
+
+def synthetic_frame(app: types.ModuleType, rows: int, seed: int = 0) -> pd.DataFrame:
+    """Frame mentah ala worksheet RekapSO, diproses lewat process_raw_frame milik app."""
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D")
+    qty = rng.integers(-20, 21, rows)
+    plu = rng.integers(10000, 12000, rows)
+    raw = pd.DataFrame({
+        "TANGGAL": dates.strftime("%d-%m-%Y"),
+        "SELISIH_QTY": qty,
+        "SELISIH_RP": qty * rng.integers(1000, 50000, rows),
+        "CATEGORY_NAME": rng.choice(["FOOD", "NONFOOD", "DRINK", ""], rows),
+        "DESCP": [f"Produk {code}" for code in plu],
+        "PLU": plu,
+        "TAG": rng.choice(["A", "B", "N", ""], rows),
+    })
+    return app.process_raw_frame(raw)
+
+
+def filter_by_masks(
+    app: types.ModuleType,
+    df: pd.DataFrame,
+    date_range,
+    selected_tags,
+    selected_direction
+) -> pd.DataFrame:
+    """Filter lama (copy + tiga boolean mask) sebagai pembanding."""
+    filtered = df.copy()
+    start_ts, end_ts = app._date_bounds(date_range)
+    filtered = filtered[
+        (filtered["Tanggal Stock Opname"] >= start_ts) &
+        (filtered["Tanggal Stock Opname"] <= end_ts)
+    ]
+    if selected_tags and "Semua" not in selected_tags:
+        filtered = filtered[filtered["Tag"].isin(selected_tags)]
+    if selected_direction and "Semua" not in selected_direction:
+        filtered = filtered[filtered["Arah Varians"].isin(selected_direction)]
+    return filtered
+
+
+def benchmark_filter(app: types.ModuleType, df: pd.DataFrame, multipliers=(1, 4, 16), repeats: int = 5) -> pd.DataFrame:
+    """Latensi filter mask vs FilterIndex pada dataset yang digandakan hingga beberapa kali lipat."""
+    dates = df["Tanggal Stock Opname"]
+    span = dates.max() - dates.min()
+    date_range = ((dates.min() + span / 4).date(), (dates.max() - span / 4).date())
+    tags = [str(df["Tag"].iloc[0])]
+    direction = ["Positif", "Negatif"]
+
+    rows = []
+    for multiplier in multipliers:
+        frame = pd.concat([df] * multiplier, ignore_index=True) if multiplier > 1 else df
+        frame = frame.sort_values("Tanggal Stock Opname", kind="stable")
+        build_start = time.perf_counter()
+        index = app.FilterIndex(frame)
+        build_ms = (time.perf_counter() - build_start) * 1000
+
+        timings = {}
+        for label, run in (
+            ("Mask (ms)", lambda: filter_by_masks(app, frame, date_range, tags, direction)),
+            ("Indeks (ms)", lambda: index.select(date_range, tags, direction)),
+        ):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                run()
+            timings[label] = (time.perf_counter() - start) * 1000 / repeats
+        rows.append({"Baris": len(frame), **timings, "Bangun indeks (ms)": build_ms})
+    return pd.DataFrame(rows).round(2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--snapshot", type=Path, help="Snapshot Parquet dari SO_SNAPSHOT_DIR")
+    parser.add_argument("--rows", type=int, default=50000, help="Jumlah baris data sintetis bila tanpa snapshot")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    app = load_app_definitions()
+    snapshot = args.snapshot
+    if snapshot is None:
+        snapshots = sorted(app.SNAPSHOT_DIR.glob("rekapso-*.parquet"), key=lambda path: path.stat().st_mtime)
+        snapshot = snapshots[-1] if snapshots else None
+    if snapshot is not None:
+        frame, source = app.compact_frame(pd.read_parquet(snapshot)), str(snapshot)
+    else:
+        frame, source = synthetic_frame(app, args.rows), f"sintetis ({args.rows} baris)"
+    frame = frame.dropna(subset=["Tanggal Stock Opname"])
+
+    print(f"Sumber: {source}")
+    print(benchmark_filter(app, frame, repeats=args.repeats).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Uji memori multi-sesi: jalankan N sesi dashboard dalam satu proses dan pastikan RSS datar.
+
+Setiap sesi adalah ``AppTest`` baru (session_state sendiri) yang berbagi cache proses,
+sama seperti pengunjung yang membuka dashboard di server yang sama. Data diambil dari
+snapshot sintetis di SO_SNAPSHOT_DIR sementara, jadi tidak perlu kredensial Google.
+
+Penggunaan:
+    python bench_sessions.py
+    python bench_sessions.py --rows 200000 --sessions 50 --max-growth-mb 40
+
+Keluar dengan kode 1 bila ada sesi yang tidak merender dashboard (error, warning, tanpa
+grafik) atau RSS tumbuh melebihi batas setelah pemanasan.
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+from bench_filter import APP_PATH, load_app_definitions, synthetic_frame
+
+SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/bench-sessions"
+SHEET_NAME = "RekapSO"
+
+
+def seed_snapshot(app, rows: int) -> None:
+    """Tulis snapshot yang dibaca app saat start; pembaruan latar gagal cepat tanpa kredensial."""
+    frame = synthetic_frame(app, rows)
+    frame.attrs["version"] = f"bench-{rows}"
+    app.write_snapshot((SPREADSHEET_URL, SHEET_NAME), {
+        "columns": [],
+        "row_count": rows,
+        "tail_hash": "",
+        "frame": frame,
+        "fetched_at": datetime.now()
+    })
+
+
+def run_session(timeout: float) -> AppTest:
+    session = AppTest.from_file(str(APP_PATH), default_timeout=timeout)
+    session.secrets["spreadsheet"] = {"url": SPREADSHEET_URL}
+    return session.run()
+
+
+def session_failures(session: AppTest) -> list:
+    failures = [element.value for element in session.exception]
+    failures += [element.value for element in session.error]
+    failures += [element.value for element in session.warning]
+    if not session.get("plotly_chart"):
+        failures.append("dashboard tidak merender grafik")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000, help="Jumlah baris snapshot sintetis")
+    parser.add_argument("--sessions", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3, help="Sesi awal yang tidak dihitung (muat data, cache)")
+    parser.add_argument("--max-growth-mb", type=float, default=50.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="rekapso-bench-") as snapshot_dir:
+        # SNAPSHOT_DIR dibaca dari env saat app.py dimuat, baik oleh skrip ini maupun tiap sesi
+        os.environ["SO_SNAPSHOT_DIR"] = snapshot_dir
+        app = load_app_definitions()
+        seed_snapshot(app, args.rows)
+
+        samples = []
+        for number in range(1, args.sessions + 1):
+            session = run_session(args.timeout)
+            failures = session_failures(session)
+            if failures:
+                print(f"Sesi {number} gagal: {failures[0]}")
+                return 1
+            del session
+            gc.collect()
+            samples.append({"Sesi": number, "RSS (MB)": round((app.process_rss_bytes() or 0) / 1024 ** 2, 1)})
+
+    report = pd.DataFrame(samples)
+    print(report.to_string(index=False))
+    steady = report["RSS (MB)"].iloc[min(args.warmup, len(report) - 1):]
+    growth = float(steady.max() - steady.iloc[0])
+    print(f"Pertumbuhan RSS setelah {args.warmup} sesi pemanasan: {growth:.1f} MB (batas {args.max_growth_mb:.0f} MB)")
+    return 0 if growth <= args.max_growth_mb else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())